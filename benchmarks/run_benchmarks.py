@@ -0,0 +1,346 @@
+"""
+Benchmarks for layout generation, rendering, font fitting, label conversion and OCR masking.
+
+Runs on synthetic fixture images written to a temporary directory, and with a stub easyocr
+reader, so neither the MMIU dataset nor the OCR model is needed. Results are printed and
+written as JSON; a stored baseline can be compared against to catch regressions.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --tolerance 1.25
+
+Baselines are machine specific, record one on the machine the comparison runs on. The
+import time budget of the layout modules is checked by tests/test_import_time.py.
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "stitching"))
+
+import numpy as np
+import cv2
+
+from LayoutNode import ContainerNode, ImageNode, RASTER_FONT
+from LayoutGenerator import (
+    SingleImageLayoutGenerator, GridLayoutGenerator, TextOnImageLayoutGenerator,
+    AsymmetricalColLayoutGenerator, AsymmetricalRowLayoutGenerator, seed_random, random_text
+)
+from TextFitter import TextFitter, cv2_fitter
+from ImageCache import image_cache
+
+class _StubReader:
+    """ Stands in for easyocr.Reader: one paragraph box per image, no model """
+    def readtext(self, img, paragraph=True, **kwargs):
+        h, w = img.shape[:2]
+        return [([[w // 8, h // 8], [w // 2, h // 8], [w // 2, h // 4], [w // 8, h // 4]], "stub text")]
+
+    def readtext_batched(self, images, paragraph=True, **kwargs):
+        return [self.readtext(img) for img in images]
+
+try:
+    import easyocr
+except ImportError:
+    # only the reader is used and it is stubbed below, so the benchmarks run without easyocr installed
+    sys.modules["easyocr"] = types.SimpleNamespace(Reader=lambda *a, **k: _StubReader(), __version__="stub")
+
+from utils.yolo_bbox import convert_bbox_to_yolo, convert_bboxes_to_yolo
+from utils.yolo_formatter import process_node
+from text_recognition.TextRecognizer import TextRecognizer
+
+def _stub_recognizer():
+    # a TextRecognizer whose model is the stub reader, without loading easyocr's weights
+    recognizer = TextRecognizer.__new__(TextRecognizer)
+    recognizer.languages = ["en"]
+    recognizer.reader = _StubReader()
+    recognizer.batch_size = 8
+    recognizer.cache = None
+    return recognizer
+
+# (generator, generate kwargs) per layout family, sized like the layouts in stitching/test.py
+FAMILIES = {
+    "single": (lambda: SingleImageLayoutGenerator(), dict(num_images=1, num_texts=2)),
+    "grid": (lambda: GridLayoutGenerator(2, 3, spacing=10, with_title=True), dict(num_images=4, num_texts=2)),
+    "grid_text_left": (lambda: GridLayoutGenerator(3, 2, text_only_on_left=True), dict(num_images=3, num_texts=3)),
+    "text_on_image": (lambda: TextOnImageLayoutGenerator(2, 2, spacing=10), dict(num_images=4, num_texts=2)),
+    "asymmetrical_col": (lambda: AsymmetricalColLayoutGenerator([2, 3, 1]), dict(num_images=4, num_texts=2)),
+    "asymmetrical_row": (lambda: AsymmetricalRowLayoutGenerator([1, 3, 2], text_on_image=True), dict(num_images=6, num_texts=2)),
+}
+
+def make_fixtures(fixture_dir, count=12, seed=0):
+    """ Write `count` synthetic JPEGs of assorted sizes (gradients plus noise) and return their paths """
+    rng = np.random.default_rng(seed)
+    sizes = [(640, 480), (1024, 768), (1920, 1080), (480, 640), (2048, 1536), (800, 800)]
+    paths = []
+    for i in range(count):
+        w, h = sizes[i % len(sizes)]
+        yy, xx = np.mgrid[0:h, 0:w]
+        base = np.stack([xx * 255 // w, yy * 255 // h, (xx + yy) * 255 // (w + h)], axis=-1)
+        img = np.clip(base + rng.integers(-20, 20, base.shape), 0, 255).astype(np.uint8)
+        path = os.path.join(fixture_dir, f"{i}.jpg")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+def _summary(times, items=1):
+    total = sum(times)
+    return {
+        "runs": len(times),
+        "items_per_run": items,
+        "total_s": total,
+        "mean_ms": 1000 * total / len(times),
+        "p50_ms": 1000 * statistics.median(times),
+        "p95_ms": 1000 * sorted(times)[int(0.95 * (len(times) - 1))],
+        "items_per_s": len(times) * items / total if total > 0 else float("inf"),
+        # median based, what baselines are compared on since it shrugs off the odd slow run
+        "p50_items_per_s": items / statistics.median(times) if statistics.median(times) > 0 else float("inf"),
+    }
+
+def timeit(fn, repeat, items=1):
+    """ Time fn() `repeat` times after one untimed warm-up call, each call handling `items` items """
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return _summary(times, items)
+
+def bench_generate(paths, repeat):
+    results = {}
+    for family, (make, kwargs) in FAMILIES.items():
+        generator = make()
+        def run():
+            generator.generate(800, 600, kwargs["num_images"], kwargs["num_texts"], random.sample(paths, kwargs["num_images"]))
+        results[family] = timeit(run, repeat)
+    return results
+
+def bench_add_child(counts, repeat):
+    results = {}
+    for n in counts:
+        side = int(np.ceil(np.sqrt(n)))
+        def run():
+            container = ContainerNode(0, 0, side * 10, side * 10)
+            for k in range(n):
+                container.add_child(ImageNode((k % side) * 10, (k // side) * 10, 10, 10, ""))
+        results[str(n)] = timeit(run, repeat, items=n)
+    return results
+
+def _layouts(paths, per_family):
+    layouts = {}
+    for family, (make, kwargs) in FAMILIES.items():
+        generator = make()
+        layouts[family] = [
+            generator.generate(800, 600, kwargs["num_images"], kwargs["num_texts"], random.sample(paths, kwargs["num_images"]))
+            for _ in range(per_family)
+        ]
+    return layouts
+
+def bench_save_image(layouts, out_dir, backends, repeat):
+    results = {}
+    for backend in backends:
+        for family, items in layouts.items():
+            def run():
+                for k, layout in enumerate(items):
+                    layout.save_image(os.path.join(out_dir, f"{family}_{k}.png"), backend=backend)
+            results[f"{backend}/{family}"] = timeit(run, repeat, items=len(items))
+    return results
+
+def bench_font_fit(repeat):
+    texts = [random_text(2, 12) for _ in range(200)]
+    boxes = [(random.randint(40, 400), random.randint(20, 200)) for _ in texts]
+    fitter = cv2_fitter(RASTER_FONT)
+
+    def cold():
+        # fresh fitter every run: the glyph advances stay measured, the fit cache starts empty
+        solver = TextFitter(fitter.metrics)
+        for text, (w, h) in zip(texts, boxes):
+            solver.fit(text, w, h)
+
+    def warm():
+        for text, (w, h) in zip(texts, boxes):
+            fitter.fit(text, w, h)
+
+    warm()
+    return {"cold": timeit(cold, repeat, items=len(texts)), "cached": timeit(warm, repeat, items=len(texts))}
+
+def bench_labels(layouts, repeat):
+    labels = [layout.get_label() for items in layouts.values() for layout in items]
+    bboxes = [
+        bbox for label in labels for bbox in
+        [n["bbox"] for n in _walk(label) if n["type"] == "image"]
+    ]
+
+    def scalar():
+        for bbox in bboxes:
+            convert_bbox_to_yolo((800, 600), bbox)
+
+    return {
+        "get_label": timeit(lambda: [layout.get_label() for items in layouts.values() for layout in items], repeat, items=len(labels)),
+        "convert_bbox_to_yolo": timeit(scalar, repeat, items=len(bboxes)),
+        "convert_bboxes_to_yolo": timeit(lambda: convert_bboxes_to_yolo((800, 600), bboxes), repeat, items=len(bboxes)),
+        "process_node": timeit(lambda: [process_node(label, (800, 600)) for label in labels], repeat, items=len(labels)),
+    }
+
+def _walk(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.get("children", ()))
+
+def bench_ocr_mask(layouts, repeat):
+    recognizer = _stub_recognizer()
+    images = [layout.render() for items in layouts.values() for layout in items]
+    return {
+        "get_masked_image": timeit(lambda: [recognizer.get_masked_image(img) for img in images], repeat, items=len(images)),
+        "process_batch": timeit(lambda: recognizer.process_batch(images), repeat, items=len(images)),
+    }
+
+def bench_end_to_end(paths, count, out_dir):
+    """ generate -> render -> label -> encode/write, per-stage time and overall layouts/sec """
+    stages = {"generate": 0.0, "render": 0.0, "label": 0.0, "write": 0.0}
+    families = list(FAMILIES.values())
+    start = time.perf_counter()
+    for k in range(count):
+        make, kwargs = families[k % len(families)]
+        t0 = time.perf_counter()
+        layout = make().generate(800, 600, kwargs["num_images"], kwargs["num_texts"], random.sample(paths, kwargs["num_images"]))
+        t1 = time.perf_counter()
+        img = layout.render()
+        t2 = time.perf_counter()
+        bboxes = process_node(layout.get_label(), (img.shape[1], img.shape[0]))
+        t3 = time.perf_counter()
+        cv2.imwrite(os.path.join(out_dir, f"e2e_{k}.png"), img)
+        with open(os.path.join(out_dir, f"e2e_{k}.txt"), "w") as f:
+            f.writelines(f"0 {b[0]} {b[1]} {b[2]} {b[3]}\n" for b in bboxes)
+        t4 = time.perf_counter()
+        for stage, seconds in zip(stages, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+            stages[stage] += seconds
+    wall = time.perf_counter() - start
+    return {
+        "layouts": count,
+        "wall_s": wall,
+        "layouts_per_s": count / wall,
+        "stages_s": stages,
+        "stages_share": {stage: seconds / wall for stage, seconds in stages.items()},
+    }
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def run_all(args):
+    random.seed(args.seed)
+    seed_random(args.seed)
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "seed": args.seed,
+            "quick": args.quick,
+        },
+        "benchmarks": {},
+    }
+    repeat = 3 if args.quick else args.repeat
+    bench = results["benchmarks"]
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_fixtures(tmp)
+        out_dir = os.path.join(tmp, "out")
+        os.makedirs(out_dir)
+
+        bench["generate"] = bench_generate(paths, repeat * 10)
+        bench["add_child"] = bench_add_child([16, 64, 256] if args.quick else [16, 64, 256, 1024, 4096], repeat)
+        layouts = _layouts(paths, 2 if args.quick else 5)
+        backends = ["raster"] + (["matplotlib"] if args.matplotlib else [])
+        image_cache.clear()
+        bench["save_image"] = bench_save_image(layouts, out_dir, backends, repeat)
+        bench["font_fit"] = bench_font_fit(repeat)
+        bench["labels"] = bench_labels(layouts, repeat * 10)
+        bench["ocr_mask"] = bench_ocr_mask(layouts, repeat)
+        results["end_to_end"] = bench_end_to_end(paths, 12 if args.quick else 60, out_dir)
+    results["image_cache"] = image_cache.stats()
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+def _flatten(benchmarks, prefix=""):
+    flat = {}
+    for key, value in benchmarks.items():
+        name = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict) and "items_per_s" in value:
+            flat[name] = value
+        elif isinstance(value, dict):
+            flat.update(_flatten(value, name))
+    return flat
+
+def compare(results, baseline, tolerance):
+    """
+    Throughput of every benchmark relative to the baseline.
+
+    Returns:
+    - (report, regressions): per benchmark ratios and the names that got slower than `tolerance` allows
+    """
+    current, previous = _flatten(results["benchmarks"]), _flatten(baseline["benchmarks"])
+    current["end_to_end"] = {"p50_items_per_s": results["end_to_end"]["layouts_per_s"]}
+    previous["end_to_end"] = {"p50_items_per_s": baseline["end_to_end"]["layouts_per_s"]}
+    report, regressions = {}, []
+    for name, value in current.items():
+        if name not in previous:
+            continue
+        # > 1 means slower than the baseline
+        slowdown = previous[name]["p50_items_per_s"] / value["p50_items_per_s"]
+        report[name] = {"baseline_items_per_s": previous[name]["p50_items_per_s"], "items_per_s": value["p50_items_per_s"], "slowdown": slowdown}
+        if slowdown > tolerance:
+            regressions.append(name)
+    return report, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the results JSON here (printed to stdout otherwise)")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown factor before a benchmark counts as a regression")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions and smaller sizes")
+    parser.add_argument("--matplotlib", action="store_true", help="also time the matplotlib save_image backend")
+    args = parser.parse_args(argv)
+
+    results = run_all(args)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results["comparison"], regressions = compare(results, baseline, args.tolerance)
+        results["regressions"] = regressions
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(text)
+
+    for name in regressions:
+        print(f"Regression: {name} is {results['comparison'][name]['slowdown']:.2f}x slower than the baseline", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
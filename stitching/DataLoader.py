@@ -1,61 +1,155 @@
-import os, zipfile
+import os, sys, zipfile
 from torch.utils.data import Dataset
-from datasets import load_dataset
-from huggingface_hub import list_repo_files, hf_hub_download
+from PathIndex import PathIndex
+from ZipImageSource import zip_source, zip_uri
+from ImageSampler import ImageSampler, default_group
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import instrument
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+def iter_local_images(image_dir):
+    """ Image files under image_dir, relative to it, in a stable order """
+    for root, dirs, files in os.walk(image_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(root, name), image_dir)
+
+def iter_zip_images(image_dir):
+    """ "<archive>::<member>" paths of the images inside every zip under image_dir, relative to it """
+    for root, dirs, files in os.walk(image_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith('.zip'):
+                continue
+            archive = os.path.join(root, name)
+            for member in zip_source.members(archive, IMAGE_EXTENSIONS):
+                yield zip_uri(os.path.relpath(archive, image_dir), member)
+
+def iter_mmiu_images(image_dir, extract=True):
+    """
+    Image paths of the MMIU benchmark relative to image_dir, downloading it if needed.
+
+    Parameters:
+    - extract: extract the archives into image_dir, otherwise the paths point into the
+               downloaded archives ("<archive>::<member>") and nothing is extracted
+    """
+    from datasets import load_dataset
+    from huggingface_hub import list_repo_files, hf_hub_download
+
+    dataset_name = "FanqingM/MMIU-Benchmark"
+    dataset = load_dataset(dataset_name, split="test")
+
+    # Download and extract zip files from the dataset repository
+    repo_files = list_repo_files(dataset_name, repo_type="dataset")
+    zip_files = [f for f in repo_files if f.endswith('.zip')]
+    print(zip_files)
+    if not extract:
+        archives = {}
+        for z in zip_files:
+            archive = hf_hub_download(repo_id=dataset_name, filename=z, repo_type="dataset")
+            archives[z.replace('.zip', '')] = (archive, set(zip_source.members(archive)))
+        for item in dataset:
+            for path in item["input_image_path"]:
+                path = path.lstrip("./")
+                stem, _, member = path.partition('/')
+                archive, members = archives[stem]
+                # archives either hold the files directly or under a folder of their own name
+                yield zip_uri(archive, member if member in members else path)
+        return
+
+    for z in zip_files:
+        if os.path.exists(os.path.join(image_dir, z.replace('.zip', ''))):
+            print(f"Zip file {z} already extracted, skipping download and extraction.")
+            continue
+        z1 = hf_hub_download(repo_id=dataset_name, filename=z, repo_type="dataset")
+        extract_dir = z.replace('.zip', '')
+        extract_dir = os.path.join(image_dir, extract_dir)
+        if not os.path.exists(extract_dir): # Avoid re-extracting
+            os.makedirs(extract_dir)
+            with zipfile.ZipFile(z1, 'r') as zip_ref:
+                zip_ref.extractall(extract_dir)
+        else:
+            print(f"Directory {extract_dir} already exists, skipping extraction. If it doesn't contain the required data, please delete this directory and rerun.")
+
+    # For now flattening as a list of images... Will decide later if want to keep them grouped
+    for item in dataset:
+        for path in item["input_image_path"]:
+            # Remove leading "./" if present
+            yield path.lstrip("./")
 
 class CustomDataset(Dataset):
-    def __init__(self, image_dir, transform=None):
+    """
+    Flat list of source image paths under image_dir.
+
+    The list is read from a PathIndex (see PathIndex.py) that is built on first use and
+    reused afterwards, so constructing the dataset when the index exists touches neither
+    the hub nor the zip files. Paths are joined with image_dir only when accessed.
+
+    Parameters:
+    - image_dir: root of the images
+    - source: "mmiu" for the MMIU benchmark (downloaded and extracted on first use),
+              "local" for every image file under image_dir or "zip" for every image
+              inside the zip archives under image_dir, read without extraction
+    - index_path: prefix of the index files, defaults to image_dir/.<source>_paths
+    - rebuild: build the index even if it already exists
+    - extract: for "mmiu", extract the archives instead of reading images from them
+    """
+    @instrument.timed("dataset.load")
+    def __init__(self, image_dir, transform=None, source="mmiu", index_path=None, rebuild=False, extract=True):
         self.image_dir = image_dir
         self.transform = transform
-        dataset_name = "FanqingM/MMIU-Benchmark"
-        self.dataset = load_dataset(dataset_name, split="test")
+        self.source = source
+        if index_path is None:
+            name = source if source != "mmiu" or extract else "mmiu_zip"
+            index_path = os.path.join(image_dir, f".{name}_paths")
+        self.index_path = index_path
 
-        # Download and extract zip files from the dataset repository
-        repo_files = list_repo_files(dataset_name, repo_type="dataset")
-        zip_files = [f for f in repo_files if f.endswith('.zip')]
-        print(zip_files)
-        for z in zip_files:
-            if os.path.exists(os.path.join(self.image_dir, z.replace('.zip', ''))):
-                print(f"Zip file {z} already extracted, skipping download and extraction.")
-                continue
-            z1 = hf_hub_download(repo_id=dataset_name, filename=z, repo_type="dataset")
-            extract_dir = z.replace('.zip', '')
-            extract_dir = os.path.join(self.image_dir, extract_dir)
-            if not os.path.exists(extract_dir): # Avoid re-extracting
-                os.makedirs(extract_dir)
-                with zipfile.ZipFile(z1, 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
+        if rebuild or not PathIndex.exists(self.index_path):
+            if source == "mmiu":
+                paths = iter_mmiu_images(image_dir, extract)
+            elif source == "local":
+                paths = iter_local_images(image_dir)
+            elif source == "zip":
+                paths = iter_zip_images(image_dir)
             else:
-                print(f"Directory {extract_dir} already exists, skipping extraction. If it doesn't contain the required data, please delete this directory and rerun.")
+                raise ValueError(f"Unknown source: {source}")
+            with instrument.timer("dataset.index_build"):
+                PathIndex.build(self.index_path, paths)
+            print(f"Path index written to {self.index_path}.")
 
-        self.idx = 0
+        self.paths = PathIndex(self.index_path)
+        self._sampler = None
 
-        # For now flattening as a list of images... Will decide later if want to keep them grouped
-        self.__image_paths = []
-        for item in self.dataset:
-            for path in item["input_image_path"]:
-                # Remove leading "./" if present
-                clean_path = path.lstrip("./")
-                abs_path = os.path.join(self.image_dir, clean_path)
-                self.__image_paths.append(abs_path)
-        print(f"Dataset initialized with {len(self.__image_paths)} images.")
+    def __getstate__(self):
+        # the default sampler's shared counters only travel to processes that inherit them
+        state = self.__dict__.copy()
+        state["_sampler"] = None
+        return state
 
     def __len__(self):
-        return len(self.__image_paths)
+        return len(self.paths)
 
     def __getitem__(self, idx):
-        return self.__image_paths[idx]
-    
+        return os.path.join(self.image_dir, self.paths[idx])
+
+    def groups(self):
+        """ Sub-dataset of every image, see ImageSampler.default_group """
+        return [default_group(path) for path in self.paths]
+
+    def sampler(self, **sampler_args) -> ImageSampler:
+        """ New ImageSampler over this dataset, grouped by sub-dataset if weights are given """
+        if sampler_args.get("weights") is not None and sampler_args.get("groups") is None:
+            sampler_args["groups"] = self.groups()
+        return ImageSampler(self, **sampler_args)
+
     def get_next_image(self):
-        if self.idx >= len(self.__image_paths):
-            raise IndexError("No more images in the dataset.")
-        image_path = self.__image_paths[self.idx]
-        self.idx += 1
-        return image_path
-    
+        return self.get_images(1)[0]
+
     def get_images(self, count):
-        if self.idx + count > len(self.__image_paths):
-            raise IndexError("Not enough images left in the dataset.")
-        image_paths = self.__image_paths[self.idx:self.idx + count]
-        self.idx += count
-        return image_paths
\ No newline at end of file
+        if self._sampler is None:
+            self._sampler = self.sampler(shuffle=False)
+        instrument.count("dataset.images", count)
+        return self._sampler.sample(count)
@@ -0,0 +1,199 @@
+from LayoutGenerator import LayoutGenerator, seed_random
+from multiprocessing import Pool
+from tqdm import tqdm
+import os
+import sys
+import json
+import random
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.label_store import LabelStore
+from utils import instrument
+
+class RecipeEntry:
+    """
+    One line of a generation recipe.
+
+    Parameters:
+    - generator_cls: LayoutGenerator subclass to instantiate
+    - params: keyword arguments for the generator constructor
+    - count: number of layouts to generate from this entry
+    - width, height: container size
+    - num_images, num_texts: int or (min, max) inclusive range, drawn per layout
+    - name: suffix used in output file names (defaults to the generator class name)
+    """
+    def __init__(
+        self,
+        generator_cls: type,
+        params: dict = None,
+        count: int = 1,
+        width: int = 800,
+        height: int = 600,
+        num_images = 1,
+        num_texts = 0,
+        name: str = None
+    ) -> None:
+        if not issubclass(generator_cls, LayoutGenerator):
+            raise ValueError(f"{generator_cls} is not a LayoutGenerator")
+        self.generator_cls = generator_cls
+        self.params = params or {}
+        self.count = count
+        self.width = width
+        self.height = height
+        self.num_images = num_images
+        self.num_texts = num_texts
+        self.name = name or generator_cls.__name__
+
+class GenerationTask:
+    """ Everything a worker needs to build and save one layout, fixed up front by the planner. """
+    def __init__(self, layout_id: int, entry: RecipeEntry, seed: int, num_images: int, num_texts: int, paths: list) -> None:
+        self.layout_id = layout_id
+        self.entry = entry
+        self.seed = seed
+        self.num_images = num_images
+        self.num_texts = num_texts
+        self.paths = paths
+
+    @property
+    def name(self) -> str:
+        return f"{self.layout_id}_{self.entry.name}"
+
+def _draw_count(rng: random.Random, value) -> int:
+    if isinstance(value, int):
+        return value
+    lo, hi = value
+    return rng.randint(lo, hi)
+
+def run_task(task: GenerationTask, images_dir: str, labels, backend: str = "raster") -> str:
+    """
+    Build, label and render one layout. `labels` is either a directory that gets one
+    <name>.json per layout or a LabelStore the label is appended to under <name>.
+    """
+    seed_random(task.seed)
+    entry = task.entry
+    generator = entry.generator_cls(**entry.params)
+    layout = generator.generate(entry.width, entry.height, task.num_images, task.num_texts, task.paths)
+
+    with instrument.timer("labels.write"):
+        if isinstance(labels, LabelStore):
+            labels.append(task.name, layout.get_label())
+        else:
+            with open(os.path.join(labels, f"{task.name}.json"), "w") as f:
+                json.dump(layout.get_label(), f, indent=2)
+    layout.save_image(os.path.join(images_dir, f"{task.name}.png"), backend=backend)
+    return task.name
+
+# Pool workers get the output settings once through the initializer instead of with every task
+_worker_args = None
+
+def _init_worker(images_dir: str, labels_dir: str, label_format: str, backend: str) -> None:
+    global _worker_args
+    labels = labels_dir
+    if label_format == "store":
+        # one shard prefix per worker so that writers never share a file
+        labels = LabelStore(labels_dir, prefix=f"labels-{os.getpid()}")
+    _worker_args = (images_dir, labels, backend)
+
+def _run_worker_task(task: GenerationTask) -> str:
+    return run_task(task, *_worker_args)
+
+class GenerationEngine:
+    """
+    Generates the layouts described by a recipe over a process pool.
+
+    All randomness that affects other tasks is resolved in plan(): every task gets
+    its own seed derived from (seed, layout_id), its image/text counts and a
+    contiguous, non-overlapping slice of `paths`. Workers therefore never share a
+    cursor or a counter and the output does not depend on the number of workers
+    or on scheduling order. Paths wrap around once `paths` is exhausted, unless a
+    `sampler` is given, in which case every task's paths are drawn from it in plan order.
+
+    Parameters:
+    - recipe: list of RecipeEntry
+    - paths: indexable sequence of image paths (e.g. a CustomDataset)
+    - output_dir: layouts are written to output_dir/images and output_dir/jsons
+    - num_workers: pool size (defaults to os.cpu_count())
+    - seed: base seed of the run
+    - start_id: first layout id; ids are start_id .. start_id + total count - 1
+    - path_offset: index of the first path to allocate
+    - sampler: ImageSampler to draw paths from instead of walking `paths`
+    - label_format: "json" writes output_dir/jsons/<name>.json, "store" appends to a LabelStore in output_dir/labels
+    """
+    def __init__(
+        self,
+        recipe: list[RecipeEntry],
+        paths,
+        output_dir: str,
+        num_workers: int = None,
+        seed: int = 0,
+        start_id: int = 1,
+        path_offset: int = 0,
+        backend: str = "raster",
+        chunksize: int = 16,
+        label_format: str = "json",
+        sampler=None
+    ) -> None:
+        if len(paths) == 0:
+            raise ValueError("No image paths provided")
+        self.recipe = recipe
+        self.paths = paths
+        self.output_dir = output_dir
+        self.images_dir = os.path.join(output_dir, "images")
+        if label_format not in ("json", "store"):
+            raise ValueError(f"Unknown label format: {label_format}")
+        self.label_format = label_format
+        self.labels_dir = os.path.join(output_dir, "jsons" if label_format == "json" else "labels")
+        self.num_workers = num_workers or os.cpu_count()
+        self.seed = seed
+        self.start_id = start_id
+        self.path_offset = path_offset
+        self.backend = backend
+        self.chunksize = chunksize
+        self.sampler = sampler
+
+    def task_seed(self, layout_id: int) -> int:
+        return (self.seed << 32) + layout_id
+
+    def draw_counts(self, entry: RecipeEntry, layout_id: int) -> tuple[int, int]:
+        """ (num_images, num_texts) of a layout, drawn from its own seed like plan() does """
+        rng = random.Random(self.task_seed(layout_id))
+        return _draw_count(rng, entry.num_images), _draw_count(rng, entry.num_texts)
+
+    def _allocate_paths(self, cursor: int, count: int) -> list:
+        if self.sampler is not None:
+            return self.sampler.sample(count)
+        n = len(self.paths)
+        return [self.paths[(cursor + k) % n] for k in range(count)]
+
+    def plan(self) -> list[GenerationTask]:
+        tasks = []
+        layout_id = self.start_id
+        cursor = self.path_offset
+        for entry in self.recipe:
+            for _ in range(entry.count):
+                seed = self.task_seed(layout_id)
+                num_images, num_texts = self.draw_counts(entry, layout_id)
+                paths = self._allocate_paths(cursor, num_images)
+                cursor += num_images
+                tasks.append(GenerationTask(layout_id, entry, seed, num_images, num_texts, paths))
+                layout_id += 1
+        return tasks
+
+    def run(self, tasks: list[GenerationTask] = None) -> list[str]:
+        if tasks is None:
+            tasks = self.plan()
+        os.makedirs(self.images_dir, exist_ok=True)
+        os.makedirs(self.labels_dir, exist_ok=True)
+
+        if self.num_workers <= 1:
+            if self.label_format == "json":
+                return [run_task(task, self.images_dir, self.labels_dir, self.backend) for task in tqdm(tasks)]
+            with LabelStore(self.labels_dir, prefix=f"labels-{os.getpid()}") as store:
+                return [run_task(task, self.images_dir, store, self.backend) for task in tqdm(tasks)]
+
+        names = []
+        init_args = (self.images_dir, self.labels_dir, self.label_format, self.backend)
+        with Pool(self.num_workers, initializer=_init_worker, initargs=init_args) as pool:
+            for name in tqdm(pool.imap_unordered(_run_worker_task, tasks, chunksize=self.chunksize), total=len(tasks)):
+                names.append(name)
+        return names
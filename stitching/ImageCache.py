@@ -0,0 +1,146 @@
+from collections import OrderedDict
+import io
+import threading
+import numpy as np
+from ZipImageSource import is_zip_uri, read_zip_member
+
+# Reduction factors cv2 can apply while decoding (IMREAD_REDUCED_COLOR_*), cheapest for JPEG
+_LEVELS = (1, 2, 4, 8)
+# cv2 is imported on first decode, so that importing the layout modules stays cheap
+_READ_FLAGS = {
+    1: "IMREAD_COLOR",
+    2: "IMREAD_REDUCED_COLOR_2",
+    4: "IMREAD_REDUCED_COLOR_4",
+    8: "IMREAD_REDUCED_COLOR_8",
+}
+
+def decode_image(path: str, flags: int = None) -> "np.ndarray | None":
+    """ cv2.imread that also accepts "<archive>.zip::<member>" paths, decoded from memory """
+    import cv2
+    if flags is None:
+        flags = cv2.IMREAD_COLOR
+    if is_zip_uri(path):
+        try:
+            data = read_zip_member(path)
+        except (OSError, KeyError):
+            return None
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    return cv2.imread(path, flags)
+
+def image_size(path: str) -> "tuple[int, int] | None":
+    """ (width, height) of an image as cv2.imread returns it, read from the file header only """
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(read_zip_member(path)) if is_zip_uri(path) else path) as img:
+            width, height = img.size
+            # cv2 applies the EXIF orientation, 5 to 8 swap the axes
+            if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                width, height = height, width
+    except (OSError, KeyError, ValueError):
+        return None
+    return width, height
+
+def pick_level(size: "tuple[int, int] | None", width: int = None, height: int = None) -> int:
+    """ Largest reduction factor whose level still covers a width x height box """
+    if size is None or width is None or height is None:
+        return 1
+    img_w, img_h = size
+    scale = max(width / img_w, height / img_h)
+    level = 1
+    for lvl in _LEVELS:
+        if scale * lvl <= 1:
+            level = lvl
+    return level
+
+class ImageCache:
+    """
+    Memory-bounded LRU cache of decoded source images (BGR, as cv2.imread).
+
+    Every image is kept at pyramid levels 1, 1/2, 1/4 and 1/8 on demand: a request for
+    a (width, height) box gets the smallest level that still covers the box, so a large
+    photo drawn into a small grid cell is decoded at reduced size and resized from there.
+    The level depends only on the box and the image size from the file header, and is
+    always decoded the same way (cv2's reduced decode), so a path and box give the same
+    pixels whatever the cache has seen before. Paths may point into zip archives (see
+    ZipImageSource.py).
+
+    Parameters:
+    - max_bytes: upper bound on the pixel data kept in memory
+    """
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[str, int], np.ndarray] = OrderedDict()
+        # header size of every image with a cached level, to pick levels without reading the file
+        self._sizes: dict[str, "tuple[int, int] | None"] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _put(self, key: tuple[str, int], img: np.ndarray, size: "tuple[int, int] | None") -> None:
+        if img.nbytes > self.max_bytes:
+            return
+        # another thread may have decoded the same image meanwhile
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old.nbytes
+        self._entries[key] = img
+        self._sizes[key[0]] = size
+        self.bytes += img.nbytes
+        while self.bytes > self.max_bytes:
+            (path, _), old = self._entries.popitem(last=False)
+            self.bytes -= old.nbytes
+            if not any((path, lvl) in self._entries for lvl in _LEVELS):
+                del self._sizes[path]
+
+    def get(self, path: str, width: int = None, height: int = None) -> "np.ndarray | None":
+        """
+        Decoded image for drawing into a width x height box (full resolution if no size
+        is given). Returns None if the image cannot be read.
+        """
+        with self._lock:
+            known = path in self._sizes
+            size = self._sizes.get(path)
+        if not known:
+            size = image_size(path)
+        level = pick_level(size, width, height)
+
+        with self._lock:
+            img = self._entries.get((path, level))
+            if img is not None:
+                self._entries.move_to_end((path, level))
+                self.hits += 1
+                return img
+            self.misses += 1
+
+        import cv2
+        img = decode_image(path, getattr(cv2, _READ_FLAGS[level]))
+        if img is None:
+            return None
+        with self._lock:
+            self._put((path, level), img, size)
+        return img
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+# Process-wide cache used by ImageNode
+image_cache = ImageCache()
+
+def load_image(path: str, width: int = None, height: int = None) -> "np.ndarray | None":
+    return image_cache.get(path, width, height)
@@ -0,0 +1,155 @@
+import multiprocessing
+import numpy as np
+from ZipImageSource import is_zip_uri, split_zip_uri
+
+def default_group(path: str) -> str:
+    """ Sub-dataset of a path relative to the dataset root: the archive for zip paths, else the top-level folder """
+    if is_zip_uri(path):
+        return split_zip_uri(path)[0]
+    return path.replace("\\", "/").split("/", 1)[0]
+
+class ImageSampler:
+    """
+    Draws image paths from a dataset for any number of generator processes.
+
+    Paths are split into groups (sub-datasets). Every draw first picks a group, with
+    probability proportional to `weights` (uniform over paths if no weights are given),
+    then a path inside the group:
+    - without replacement, each group is walked through a permutation that is
+      reshuffled every epoch, so no path repeats before its whole group has been used
+      and the sampler never runs out
+    - with replacement, paths are drawn uniformly from the group
+
+    The positions of all groups live in one shared array, and a batch is allocated by
+    a single atomic fetch-and-add under the array's lock. Processes that inherit the
+    sampler (fork or Pool initializer) therefore pull disjoint paths, while the
+    permutations are recomputed locally from (seed, group, epoch) with no coordination.
+    The group choices and the draws with replacement come from an RNG seeded with
+    (seed, first draw) of each batch, the draw counter being allocated in the same
+    array, so these differ between processes as well.
+    Alternatively shard() gives each worker a disjoint subset with counters of its own.
+
+    Parameters:
+    - paths: indexable sequence of image paths (e.g. a CustomDataset)
+    - replacement: sample with replacement
+    - shuffle: reshuffle every epoch, otherwise each group is walked in order
+    - seed: seed of the permutations and of the group draws
+    - weights: dict of group -> relative weight, groups missing from it get weight 0
+    - groups: group of every path, defaults to default_group of each path when weights are given
+    """
+    def __init__(self, paths, replacement: bool = False, shuffle: bool = True, seed: int = 0, weights: dict = None, groups=None, _members=None) -> None:
+        if len(paths) == 0:
+            raise ValueError("No image paths provided")
+        self.paths = paths
+        self.replacement = replacement
+        self.shuffle = shuffle
+        self.seed = seed
+        self.weights = weights
+
+        if _members is not None:
+            self.group_names, self.members = _members
+        elif weights is None:
+            # a single group, no need to look at the paths
+            self.group_names, self.members = ["all"], [np.arange(len(paths), dtype=np.int64)]
+        else:
+            if groups is None:
+                groups = [default_group(p) for p in paths]
+            groups = np.asarray(groups)
+            self.group_names = sorted(set(groups.tolist()))
+            self.members = [np.flatnonzero(groups == name) for name in self.group_names]
+
+        probs = np.array([len(m) for m in self.members], dtype=np.float64)
+        if weights is not None:
+            probs = np.array([weights.get(name, 0.0) if len(m) else 0.0 for name, m in zip(self.group_names, self.members)], dtype=np.float64)
+        if probs.sum() <= 0:
+            raise ValueError("Sampling weights select no images")
+        self.probs = probs / probs.sum()
+
+        # positions of every group, then the number of draws so far
+        self._positions = multiprocessing.Array("q", len(self.members) + 1)
+        self._perms: dict[tuple[int, int], np.ndarray] = {}
+
+    def _perm(self, group: int, epoch: int) -> np.ndarray:
+        perm = self._perms.get((group, epoch))
+        if perm is None:
+            n = len(self.members[group])
+            perm = np.random.default_rng([self.seed, group, epoch]).permutation(n) if self.shuffle else np.arange(n)
+            # only the latest epoch of a group is ever needed again
+            self._perms = {key: p for key, p in self._perms.items() if key[0] != group or key[1] > epoch}
+            self._perms[(group, epoch)] = perm
+        return perm
+
+    def _allocate_draws(self, count: int) -> int:
+        """ Atomically reserves count draws, returns the first one """
+        with self._positions.get_lock():
+            first = self._positions[-1]
+            self._positions[-1] += count
+        return first
+
+    def _allocate(self, counts: np.ndarray) -> np.ndarray:
+        """ Atomically reserves counts[g] positions in every group, returns the first position of each """
+        starts = np.zeros(len(counts), dtype=np.int64)
+        with self._positions.get_lock():
+            for g, count in enumerate(counts):
+                starts[g] = self._positions[g]
+                self._positions[g] += int(count)
+        return starts
+
+    def _take(self, group: int, start: int, count: int, rng: np.random.Generator) -> np.ndarray:
+        members = self.members[group]
+        if self.replacement:
+            return members[rng.integers(0, len(members), count)]
+        positions = np.arange(start, start + count)
+        epochs, offsets = np.divmod(positions, len(members))
+        out = np.empty(count, dtype=np.int64)
+        for epoch in np.unique(epochs):
+            sel = epochs == epoch
+            out[sel] = members[self._perm(group, int(epoch))[offsets[sel]]]
+        return out
+
+    def sample_indices(self, count: int) -> np.ndarray:
+        """ Indices into `paths` of the next `count` draws """
+        rng = np.random.default_rng([self.seed, len(self.members), self._allocate_draws(count)])
+        if len(self.members) == 1:
+            choice = np.zeros(count, dtype=np.int64)
+        else:
+            choice = rng.choice(len(self.members), size=count, p=self.probs)
+        counts = np.bincount(choice, minlength=len(self.members))
+        starts = np.zeros(len(counts), dtype=np.int64) if self.replacement else self._allocate(counts)
+
+        out = np.empty(count, dtype=np.int64)
+        for g in np.flatnonzero(counts):
+            out[choice == g] = self._take(g, int(starts[g]), int(counts[g]), rng)
+        return out
+
+    def sample(self, count: int) -> list:
+        return [self.paths[int(i)] for i in self.sample_indices(count)]
+
+    def next(self):
+        return self.sample(1)[0]
+
+    def shard(self, index: int, num_shards: int) -> "ImageSampler":
+        """ Sampler over every num_shards-th path of each group, starting at `index`, with its own positions """
+        if not 0 <= index < num_shards:
+            raise ValueError(f"Shard index {index} out of range for {num_shards} shards")
+        members = [m[index::num_shards] for m in self.members]
+        return ImageSampler(
+            self.paths, self.replacement, self.shuffle, seed=hash((self.seed, index, num_shards)) & 0xFFFFFFFF,
+            weights=self.weights, _members=(self.group_names, members)
+        )
+
+    @property
+    def epoch(self) -> int:
+        """ Number of completed passes over the slowest group """
+        with self._positions.get_lock():
+            positions = list(self._positions[:-1])
+        return min(p // len(m) for p, m, w in zip(positions, self.members, self.probs) if w > 0)
+
+    def state(self) -> list[int]:
+        """ Positions of every group and the draw counter, to resume sampling with restore() """
+        with self._positions.get_lock():
+            return list(self._positions)
+
+    def restore(self, state: list[int]) -> None:
+        with self._positions.get_lock():
+            self._positions[:] = state
@@ -0,0 +1,294 @@
+from LayoutNode import LayoutNode, ContainerNode, ImageNode, TextNode
+import io
+import json
+import numpy as np
+
+NODE_CONTAINER = 0
+NODE_IMAGE = 1
+NODE_TEXT = 2
+
+_TYPE_NAMES = {NODE_CONTAINER: "container", NODE_IMAGE: "image", NODE_TEXT: "text"}
+_COLUMNS = ("x", "y", "w", "h", "depth", "kind", "parent", "ref")
+
+class LayoutArray:
+    """
+    Struct-of-arrays storage for one or many layouts.
+
+    Nodes of all layouts live in the same columns, in pre-order, and the nodes of
+    layout i are rows offsets[i]:offsets[i+1]. For every node:
+    - x, y, w, h, depth: geometry and depth, as on LayoutNode
+    - kind: NODE_CONTAINER, NODE_IMAGE or NODE_TEXT
+    - parent: row of the parent node, -1 for the root of a layout
+    - ref: index into `paths` for images, into `texts` for texts, -1 for containers
+    Image paths are interned, so a source image used by many layouts is stored once.
+    """
+    def __init__(self, x, y, w, h, depth, kind, parent, ref, offsets, paths: list[str], texts: list[str]) -> None:
+        self.x = np.asarray(x, dtype=np.int32)
+        self.y = np.asarray(y, dtype=np.int32)
+        self.w = np.asarray(w, dtype=np.int32)
+        self.h = np.asarray(h, dtype=np.int32)
+        self.depth = np.asarray(depth, dtype=np.int16)
+        self.kind = np.asarray(kind, dtype=np.uint8)
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.ref = np.asarray(ref, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.paths = paths
+        self.texts = texts
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.kind)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, c).nbytes for c in _COLUMNS) + self.offsets.nbytes
+
+    def layout_of(self) -> np.ndarray:
+        # layout index of every node
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+    def bboxes(self, kind: int = None, layout: int = None) -> np.ndarray:
+        """ (N, 4) array of (tl_x, tl_y, br_x, br_y), optionally filtered by node kind and layout """
+        rows = self._rows(kind, layout)
+        return np.stack([self.x[rows], self.y[rows], self.x[rows] + self.w[rows], self.y[rows] + self.h[rows]], axis=1)
+
+    def _rows(self, kind: int = None, layout: int = None) -> np.ndarray:
+        if layout is None:
+            rows = np.arange(self.num_nodes)
+        else:
+            rows = np.arange(self.offsets[layout], self.offsets[layout + 1])
+        if kind is not None:
+            rows = rows[self.kind[rows] == kind]
+        return rows
+
+    def overlaps(self, rect: tuple, kind: int = None, layout: int = None) -> np.ndarray:
+        """ Rows of the nodes whose bbox intersects rect = (tl_x, tl_y, br_x, br_y) """
+        rows = self._rows(kind, layout)
+        x1, y1, x2, y2 = rect
+        hit = ((self.x[rows] < x2) & (self.x[rows] + self.w[rows] > x1) &
+               (self.y[rows] < y2) & (self.y[rows] + self.h[rows] > y1))
+        return rows[hit]
+
+    @classmethod
+    def from_tree(cls, node: LayoutNode) -> "LayoutArray":
+        return cls.from_trees([node])
+
+    @classmethod
+    def from_trees(cls, nodes: list[LayoutNode]) -> "LayoutArray":
+        cols = {c: [] for c in _COLUMNS}
+        offsets = [0]
+        paths, path_ids, texts = [], {}, []
+
+        for root in nodes:
+            stack = [(root, -1)]
+            while stack:
+                node, parent = stack.pop()
+                row = len(cols["x"])
+                if isinstance(node, ContainerNode):
+                    kind, ref = NODE_CONTAINER, -1
+                    stack.extend((child, row) for child in reversed(node.children))
+                elif isinstance(node, ImageNode):
+                    kind = NODE_IMAGE
+                    ref = path_ids.setdefault(node.image_path, len(paths))
+                    if ref == len(paths):
+                        paths.append(node.image_path)
+                elif isinstance(node, TextNode):
+                    kind, ref = NODE_TEXT, len(texts)
+                    texts.append(node.text)
+                else:
+                    raise ValueError(f"Unknown node type: {type(node)}")
+
+                for c, v in zip(_COLUMNS, (node.x, node.y, node.width, node.height, node.depth, kind, parent, ref)):
+                    cols[c].append(v)
+            offsets.append(len(cols["x"]))
+
+        return cls(**cols, offsets=offsets, paths=paths, texts=texts)
+
+    @classmethod
+    def concat(cls, arrays: list["LayoutArray"]) -> "LayoutArray":
+        cols = {c: [] for c in _COLUMNS}
+        offsets = [np.zeros(1, dtype=np.int64)]
+        paths, path_ids, texts = [], {}, []
+        base = 0
+        for arr in arrays:
+            path_map = []
+            for p in arr.paths:
+                if p not in path_ids:
+                    path_ids[p] = len(paths)
+                    paths.append(p)
+                path_map.append(path_ids[p])
+            path_map = np.array(path_map or [0], dtype=np.int32)
+            for c in ("x", "y", "w", "h", "depth", "kind"):
+                cols[c].append(getattr(arr, c))
+            cols["parent"].append(np.where(arr.parent >= 0, arr.parent + base, -1))
+            ref = arr.ref.copy()
+            ref[arr.kind == NODE_IMAGE] = path_map[arr.ref[arr.kind == NODE_IMAGE]]
+            ref[arr.kind == NODE_TEXT] += len(texts)
+            cols["ref"].append(ref)
+            texts.extend(arr.texts)
+            offsets.append(arr.offsets[1:] + base)
+            base += arr.num_nodes
+        return cls(**{c: np.concatenate(v) if v else [] for c, v in cols.items()},
+                   offsets=np.concatenate(offsets), paths=paths, texts=texts)
+
+    def _make_node(self, row: int) -> LayoutNode:
+        args = (int(self.x[row]), int(self.y[row]), int(self.w[row]), int(self.h[row]))
+        kind = self.kind[row]
+        if kind == NODE_CONTAINER:
+            return ContainerNode(*args)
+        if kind == NODE_IMAGE:
+            return ImageNode(*args, self.paths[self.ref[row]])
+        return TextNode(*args, self.texts[self.ref[row]])
+
+    def to_tree(self, layout: int = 0) -> LayoutNode:
+        start, end = self.offsets[layout], self.offsets[layout + 1]
+        nodes = {}
+        root = None
+        # pre-order guarantees that a parent is built before its children
+        for row in range(start, end):
+            node = self._make_node(row)
+            nodes[row] = node
+            parent = self.parent[row]
+            if parent < 0:
+                root = node
+            else:
+                nodes[parent].add_child(node)
+        return root
+
+    def get_label(self, layout: int = 0) -> dict:
+        """ Same nested dict as LayoutNode.get_label(), built straight from the columns """
+        start, end = self.offsets[layout], self.offsets[layout + 1]
+        cols = [getattr(self, c)[start:end].tolist() for c in _COLUMNS]
+        labels = []
+        root = None
+        for x, y, w, h, depth, kind, parent, ref in zip(*cols):
+            label = {
+                "type": _TYPE_NAMES[kind],
+                "bbox": (x, y, x + w, y + h),
+                "depth": depth,
+            }
+            if kind == NODE_CONTAINER:
+                label["children"] = []
+            elif kind == NODE_IMAGE:
+                label["image_path"] = self.paths[ref]
+            else:
+                label["text"] = self.texts[ref]
+            labels.append(label)
+
+            if parent < 0:
+                root = label
+            else:
+                labels[parent - start]["children"].append(label)
+        return root
+
+    def to_bytes(self) -> bytes:
+        buf = io.BytesIO()
+        strings = json.dumps({"paths": self.paths, "texts": self.texts}).encode()
+        np.savez(buf, offsets=self.offsets, strings=np.frombuffer(strings, dtype=np.uint8),
+                 **{c: getattr(self, c) for c in _COLUMNS})
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "LayoutArray":
+        with np.load(io.BytesIO(data)) as f:
+            strings = json.loads(f["strings"].tobytes().decode())
+            return cls(**{c: f[c] for c in _COLUMNS}, offsets=f["offsets"], **strings)
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> "LayoutArray":
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+class LayoutArrayBuilder:
+    """
+    Assembles a LayoutArray for n layouts at once from column arrays, for generators that
+    draw their randomness with NumPy. Every add_* call places one node in each layout
+    selected by `mask`; nodes must be added in pre-order within each layout (a container
+    before its children), but layouts are interleaved freely. Coordinates, depths and
+    parents are (n,) arrays (or scalars), entries of unselected layouts are ignored.
+
+    Every layout starts with a root container of the given size at depth 0, whose
+    returned index is ROOT. Depths are given by the caller, except that a lone container
+    child of the root is moved up to the root's depth in build(), as add_child does.
+
+    Parameters:
+    - n: number of layouts
+    - container_width, container_height: root size
+    - paths: source image pool, image refs index it modulo its length (no paths if None)
+    - texts: callable returning a list of that many texts, "" for all text nodes if None
+    """
+    ROOT = 0
+
+    def __init__(self, n: int, container_width: int, container_height: int, paths=None, texts=None) -> None:
+        self.n = n
+        self.pool = paths
+        self.text_source = texts
+        self._chunks = []
+        self._cursor = np.zeros(n, dtype=np.int64)
+        everyone = np.ones(n, dtype=bool)
+        self._add(everyone, 0, 0, container_width, container_height, 0, NODE_CONTAINER, -1, -1)
+
+    def _add(self, mask, x, y, w, h, depth, kind, parent, ref) -> np.ndarray:
+        mask = np.asarray(mask, dtype=bool)
+        layouts = np.flatnonzero(mask)
+        seq = self._cursor[layouts]
+        self._cursor[layouts] += 1
+        pick = lambda v: np.broadcast_to(np.asarray(v), (self.n,))[layouts]
+        self._chunks.append((layouts, seq, pick(x), pick(y), pick(w), pick(h), pick(depth),
+                             np.full(len(layouts), kind), pick(parent), pick(ref)))
+        index = np.full(self.n, -1, dtype=np.int64)
+        index[layouts] = seq
+        return index
+
+    def add_container(self, mask, x, y, w, h, depth, parent=ROOT) -> np.ndarray:
+        return self._add(mask, x, y, w, h, depth, NODE_CONTAINER, parent, -1)
+
+    def add_image(self, mask, x, y, w, h, depth, path_index, parent=ROOT) -> np.ndarray:
+        return self._add(mask, x, y, w, h, depth, NODE_IMAGE, parent, path_index)
+
+    def add_text(self, mask, x, y, w, h, depth, parent=ROOT) -> np.ndarray:
+        return self._add(mask, x, y, w, h, depth, NODE_TEXT, parent, -1)
+
+    def build(self) -> LayoutArray:
+        cols = [np.concatenate(parts) for parts in zip(*self._chunks)]
+        layouts, seq = cols[0], cols[1]
+        order = np.lexsort((seq, layouts))
+        layouts, seq, x, y, w, h, depth, kind, parent, ref = [c[order] for c in cols]
+
+        counts = np.bincount(layouts, minlength=self.n)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        parent = np.where(parent >= 0, offsets[layouts] + parent, -1)
+
+        # a root whose only child is a container keeps that child at its own depth
+        root_children = np.bincount(layouts[parent == offsets[layouts]], minlength=self.n)
+        first_child = np.minimum(offsets[:-1] + 1, len(kind) - 1)
+        lone = (root_children == 1) & (counts > 1) & (kind[first_child] == NODE_CONTAINER)
+        depth = depth - ((parent >= 0) & lone[layouts])
+
+        paths = []
+        is_image = kind == NODE_IMAGE
+        if is_image.any():
+            if self.pool is None:
+                paths = [""]
+                ref[is_image] = 0
+            else:
+                used, inverse = np.unique(ref[is_image] % len(self.pool), return_inverse=True)
+                paths = [self.pool[int(i)] for i in used]
+                ref[is_image] = inverse
+
+        is_text = kind == NODE_TEXT
+        if self.text_source is None:
+            texts = [""]
+            ref[is_text] = 0
+        else:
+            texts = list(self.text_source(int(is_text.sum())))
+            ref[is_text] = np.arange(len(texts))
+
+        return LayoutArray(x, y, w, h, depth, kind, parent, ref, offsets, paths, texts)
@@ -1,23 +1,123 @@
 from LayoutNode import LayoutNode, ContainerNode, ImageNode, TextNode
+from LayoutArray import LayoutArray, LayoutArrayBuilder, NODE_TEXT
+from TextSource import text_source
+from utils import instrument
 from abc import ABC, abstractmethod
+import numpy as np
 import random
-import faker
-
-fake = faker.Faker()
 
 # TODO: Check if paths has atleast num_images elements
 
+def seed_random(seed: int) -> None:
+    # the text source keeps its own RNG, seed both so that a layout is reproducible from one seed
+    random.seed(seed)
+    text_source.seed(seed)
+
 def random_text(min_words=2, max_words=5) -> str:
-    cnt = random.randint(min_words, max_words)
-    words = fake.words(nb=cnt)
-    words = " ".join(words)
-    return words
+    return text_source.text(min_words, max_words)
+
+def _randint(rng: np.random.Generator, lo, hi) -> np.ndarray:
+    # inclusive bounds like random.randint, element-wise over arrays
+    return rng.integers(lo, np.asarray(hi) + 1)
+
+def _counts(value, n: int) -> np.ndarray:
+    return np.array(np.broadcast_to(np.asarray(value, dtype=np.int64), (n,)))
+
+def _add_text_on_image(builder: LayoutArrayBuilder, rng: np.random.Generator, mask, x, y, w, h, path_index) -> None:
+    # a container holding an image with a text somewhere on it, as the generators build for text on image
+    txth = _randint(rng, h // 4, h // 2)
+    txtw = _randint(rng, w // 3, w)
+    txtx = _randint(rng, x, x + w - txtw)
+    txty = _randint(rng, y, y + h - txth)
+    covered = (txtw > 0) & (txth > 0) & (w > 0) & (h > 0)
+    sub = builder.add_container(mask, x, y, w, h, 1)
+    builder.add_image(mask, x, y, w, h, 2 + covered, path_index, parent=sub)
+    builder.add_text(mask, txtx, txty, txtw, txth, 2, parent=sub)
+
+def _title_heights(builder: LayoutArrayBuilder, rng: np.random.Generator, n: int, container_width: int, container_height: int, rows) -> np.ndarray:
+    th = _randint(rng, container_height // (3 * (rows + 1)), container_height // (rows + 1))
+    builder.add_text(np.ones(n, dtype=bool), 0, 0, container_width, th, 1)
+    return th
+
+def _fill_cells_batch(builder: LayoutArrayBuilder, rng: np.random.Generator, cells: list, num_images: np.ndarray, num_texts: np.ndarray, text_on_image: bool, path_base: np.ndarray) -> None:
+    """
+    Fill fixed cells like the asymmetrical generators do: each cell is a text with probability
+    remaining texts / (remaining texts + remaining images), an image otherwise. Cells left
+    after both counts are used up stay empty, where generate() raises instead.
+    """
+    img_cnt = np.zeros_like(num_images)
+    for x, y, w, h in cells:
+        nt, ni = np.maximum(num_texts, 0), np.maximum(num_images, 0)
+        active = (nt + ni) > 0
+        text = active & (rng.random(len(nt)) * np.maximum(nt + ni, 1) < nt)
+        image = active & ~text
+        if text_on_image:
+            _add_text_on_image(builder, rng, text, x, y, w, h, path_base + img_cnt)
+            img_cnt += text
+            num_images -= text
+        else:
+            builder.add_text(text, x, y, w, h, 1)
+        num_texts -= text
+        builder.add_image(image, x, y, w, h, 1, path_base + img_cnt)
+        img_cnt += image
+        num_images -= image
 
 class LayoutGenerator(ABC):
+    def __init_subclass__(cls, **kwargs):
+        # time generate() of every concrete generator as its own stage
+        super().__init_subclass__(**kwargs)
+        if "generate" in cls.__dict__:
+            cls.generate = instrument.timed(f"generate.{cls.__name__}")(cls.__dict__["generate"])
+
     @abstractmethod
     def generate(self, container_width:int, container_height:int, num_images:int, num_texts:int, paths: list) -> LayoutNode:
         pass
 
+    def generate_batch(self, n: int, container_width: int, container_height: int, num_images, num_texts, paths: list = None, seed=None, with_text: bool = False) -> LayoutArray:
+        """
+        Generate n layouts into a LayoutArray, nodes are only built by LayoutArray.to_tree.
+
+        Generators with a vectorized implementation draw all their randomness for the n
+        layouts as NumPy arrays; this default calls generate() n times.
+
+        Parameters:
+        - num_images, num_texts: int, or (n,) array with the counts of every layout
+        - paths: source image pool, layout i uses the num_images[i] paths after those of
+                 the layouts before it, wrapping around the pool (empty paths if None)
+        - seed: seed or np.random.Generator
+        - with_text: fill text nodes with words from text_source, otherwise all texts are empty,
+                     which is enough for labels and much faster
+        """
+        rng = np.random.default_rng(seed)
+        num_images, num_texts = _counts(num_images, n), _counts(num_texts, n)
+        path_base = np.concatenate([[0], np.cumsum(num_images)[:-1]])
+        layouts = []
+        # generate() draws from the global random and text_source, give them back to the caller as they were
+        random_state, text_state = random.getstate(), text_source.getstate()
+        try:
+            for i in range(n):
+                seed_random(int(rng.integers(2**63)))
+                layout_paths = [paths[(path_base[i] + k) % len(paths)] if paths is not None else "" for k in range(num_images[i])]
+                layouts.append(self.generate(container_width, container_height, int(num_images[i]), int(num_texts[i]), layout_paths))
+        finally:
+            random.setstate(random_state)
+            text_source.setstate(text_state)
+        batch = LayoutArray.from_trees(layouts)
+        if not with_text:
+            # as LayoutArrayBuilder without a text source: every text node refers to one empty text
+            batch.texts = [""]
+            batch.ref[batch.kind == NODE_TEXT] = 0
+        return batch
+
+    @staticmethod
+    def _batch_setup(n: int, container_width: int, container_height: int, num_images, num_texts, paths, seed, with_text):
+        rng = np.random.default_rng(seed)
+        num_images, num_texts = _counts(num_images, n), _counts(num_texts, n)
+        path_base = np.concatenate([[0], np.cumsum(num_images)[:-1]])
+        texts = (lambda count: text_source.texts(count, rng=rng)) if with_text else None
+        builder = LayoutArrayBuilder(n, container_width, container_height, paths, texts)
+        return rng, num_images, num_texts, path_base, builder
+
 class SingleImageLayoutGenerator(LayoutGenerator):
     def generate(self, container_width: int, container_height: int, num_images: int, num_texts: int, paths: list) -> LayoutNode:
         if num_images == 0:
@@ -169,6 +269,54 @@ class GridLayoutGenerator(LayoutGenerator):
                     num_texts -= 1
 
         return container
+
+    def generate_batch(self, n: int, container_width: int, container_height: int, num_images, num_texts, paths: list = None, seed=None, with_text: bool = False) -> LayoutArray:
+        rng, num_images, num_texts, path_base, builder = self._batch_setup(n, container_width, container_height, num_images, num_texts, paths, seed, with_text)
+        if (num_images == 0).any():
+            raise ValueError("No images provided")
+
+        # Special cases: per layout rows, without overriding the preset ones
+        text_only = self.text_only_on_left or self.text_only_on_right
+        if text_only:
+            rows, cols = np.minimum(num_images, num_texts), 2
+            if (rows == 0).any():
+                raise ValueError("No texts provided")
+        else:
+            rows, cols = np.full(n, self.rows), self.cols
+
+        th = _title_heights(builder, rng, n, container_width, container_height, rows) if self.with_title else np.zeros(n, dtype=np.int64)
+        cell_width = container_width // cols
+        cell_height = (container_height - th) // rows
+        img_cnt = np.zeros(n, dtype=np.int64)
+
+        for row in range(int(rows.max())):
+            in_grid = row < rows
+            for col in range(cols):
+                x = col * cell_width + self.spacing // 2
+                y = row * cell_height + self.spacing // 2 + th
+                w = cell_width - self.spacing
+                h = cell_height - self.spacing
+
+                if text_only:
+                    if (self.text_only_on_left and col == 0) or (self.text_only_on_right and col == 1):
+                        builder.add_text(in_grid, x, y, w, h, 1)
+                        num_texts -= in_grid
+                    else:
+                        builder.add_image(in_grid, x, y, w, h, 1, path_base + img_cnt)
+                        num_images -= in_grid
+                        img_cnt += in_grid
+                    continue
+
+                coin = rng.random(n) < 0.5
+                image = in_grid & (num_images > 0) & (((num_texts > 0) & coin) | (num_texts == 0))
+                text = in_grid & ~image & (num_texts > 0)
+                builder.add_image(image, x, y, w, h, 1, path_base + img_cnt)
+                builder.add_text(text, x, y, w, h, 1)
+                num_images -= image
+                img_cnt += image
+                num_texts -= text
+
+        return builder.build()
     
 class TextOnImageLayoutGenerator(LayoutGenerator):
     def __init__(self, rows:int, cols:int, spacing:int=0, with_title:bool=False):
@@ -227,6 +375,33 @@ class TextOnImageLayoutGenerator(LayoutGenerator):
                 num_images -= 1
 
         return container
+
+    def generate_batch(self, n: int, container_width: int, container_height: int, num_images, num_texts, paths: list = None, seed=None, with_text: bool = False) -> LayoutArray:
+        rng, num_images, num_texts, path_base, builder = self._batch_setup(n, container_width, container_height, num_images, num_texts, paths, seed, with_text)
+        if (num_images < self.rows * self.cols).any():
+            raise ValueError("Less images provided")
+        num_texts = np.minimum(num_texts, num_images)
+
+        th = _title_heights(builder, rng, n, container_width, container_height, self.rows) if self.with_title else np.zeros(n, dtype=np.int64)
+        cell_width = container_width // self.cols
+        cell_height = (container_height - th) // self.rows
+
+        for row in range(self.rows):
+            for col in range(self.cols):
+                x = col * cell_width + self.spacing // 2
+                y = row * cell_height + self.spacing // 2 + th
+                w = cell_width - self.spacing
+                h = cell_height - self.spacing
+                img_cnt = row * self.cols + col
+
+                # Place text on image, weighted by the remaining texts and images
+                text = rng.random(n) * (num_texts + num_images) < num_texts
+                _add_text_on_image(builder, rng, text, x, y, w, h, path_base + img_cnt)
+                builder.add_image(~text, x, y, w, h, 1, path_base + img_cnt)
+                num_texts -= text
+                num_images -= 1
+
+        return builder.build()
     
 class AsymmetricalColLayoutGenerator(LayoutGenerator):
     def __init__(self, rowlist: list[int], spacing:int=0, text_on_image:bool=False):
@@ -279,6 +454,23 @@ class AsymmetricalColLayoutGenerator(LayoutGenerator):
                     num_images -= 1
 
         return container
+
+    def generate_batch(self, n: int, container_width: int, container_height: int, num_images, num_texts, paths: list = None, seed=None, with_text: bool = False) -> LayoutArray:
+        rng, num_images, num_texts, path_base, builder = self._batch_setup(n, container_width, container_height, num_images, num_texts, paths, seed, with_text)
+        if (num_images == 0).any():
+            raise ValueError("No images provided")
+
+        # the cells are the same for every layout, only their contents are drawn per layout
+        cells = []
+        cell_width = container_width // self.cols
+        for col in range(self.cols):
+            cell_height = container_height // self.rowlist[col]
+            for row in range(self.rowlist[col]):
+                cells.append((col * cell_width + self.spacing // 2, row * cell_height + self.spacing // 2,
+                              cell_width - self.spacing, cell_height - self.spacing))
+
+        _fill_cells_batch(builder, rng, cells, num_images, num_texts, self.text_on_image, path_base)
+        return builder.build()
     
 class AsymmetricalRowLayoutGenerator(LayoutGenerator):
     def __init__(self, collist: list[int], spacing:int=0, text_on_image:bool=False):
@@ -330,4 +522,21 @@ class AsymmetricalRowLayoutGenerator(LayoutGenerator):
                     img_cnt += 1
                     num_images -= 1
 
-        return container
\ No newline at end of file
+        return container
+
+    def generate_batch(self, n: int, container_width: int, container_height: int, num_images, num_texts, paths: list = None, seed=None, with_text: bool = False) -> LayoutArray:
+        rng, num_images, num_texts, path_base, builder = self._batch_setup(n, container_width, container_height, num_images, num_texts, paths, seed, with_text)
+        if (num_images == 0).any():
+            raise ValueError("No images provided")
+
+        # the cells are the same for every layout, only their contents are drawn per layout
+        cells = []
+        cell_height = container_height // self.rows
+        for row in range(self.rows):
+            cell_width = container_width // self.collist[row]
+            for col in range(self.collist[row]):
+                cells.append((col * cell_width + self.spacing // 2, row * cell_height + self.spacing // 2,
+                              cell_width - self.spacing, cell_height - self.spacing))
+
+        _fill_cells_batch(builder, rng, cells, num_images, num_texts, self.text_on_image, path_base)
+        return builder.build()
@@ -1,10 +1,26 @@
 from abc import ABC, abstractmethod
-import matplotlib.pyplot as plt
-from matplotlib import patches
-from matplotlib import font_manager as fm
-import matplotlib.patheffects as patheffects
-import textwrap
-import cv2
+import os
+import sys
+import numpy as np
+from TextFitter import cv2_fitter, cv2_font_scale, matplotlib_fitter
+from ImageCache import load_image
+from SpatialIndex import SpatialIndex, intersects
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import instrument
+
+# Layers used by the raster backend: matplotlib always draws images (zorder 0)
+# below text (zorder 3), so the raster compositor paints them in two passes.
+RASTER_IMAGE_LAYER = 0
+RASTER_TEXT_LAYER = 1
+RASTER_FRAME_LAYER = 2
+RASTER_FONT = 2  # cv2.FONT_HERSHEY_DUPLEX
+
+# matplotlib and cv2 are imported by the drawing methods that use them, building layouts
+# and labels (all a label-only worker does) never loads either of them
+
+# When set, every cached image_count/text_count read is checked against a full recount
+DEBUG_COUNTS = os.environ.get("LAYOUT_DEBUG_COUNTS", "0") == "1"
 
 class LayoutNode(ABC):
     def __init__(
@@ -19,13 +35,14 @@ class LayoutNode(ABC):
         self.width = width
         self.height = height
         self.depth: int = 0
+        self.parent: "ContainerNode | None" = None
+        # Aggregate counts of the subtree, containers keep them up to date on add/remove
         self._image_count = 0
         self._text_count = 0
 
     @property
     @abstractmethod
     def image_count(self) -> int:
-        # Currently, it is computed every time but can be cached (seems dangerous)
         pass
 
     @property
@@ -49,6 +66,13 @@ class LayoutNode(ABC):
     def _draw_node(self, ax) -> None:
         pass
 
+    @abstractmethod
+    def _raster_node(self, canvas: np.ndarray, ox: int, oy: int, layer: int) -> None:
+        pass
+
+# Containers with more children than this answer overlap queries through a SpatialIndex
+SIBLING_INDEX_THRESHOLD = 16
+
 class ContainerNode(LayoutNode):
     def __init__(
         self,
@@ -60,59 +84,150 @@ class ContainerNode(LayoutNode):
         super().__init__(x, y, width, height)
         self.children: list[LayoutNode] = []
         # self.children = []
+        # spatial index over children, built once there are enough of them
+        self._index: SpatialIndex | None = None
 
     @property
     def image_count(self) -> int:
-        return sum(child.image_count for child in self.children)
+        if DEBUG_COUNTS:
+            self._check_counts()
+        return self._image_count
 
     @property
     def text_count(self) -> int:
-        return sum(child.text_count for child in self.children)
+        if DEBUG_COUNTS:
+            self._check_counts()
+        return self._text_count
+
+    def recount(self) -> tuple[int, int]:
+        # Full walk of the subtree, returns (image_count, text_count)
+        images, texts = 0, 0
+        for child in self.children:
+            if isinstance(child, ContainerNode):
+                i, t = child.recount()
+            else:
+                i, t = child._image_count, child._text_count
+            images += i
+            texts += t
+        return images, texts
+
+    def _check_counts(self) -> None:
+        actual = self.recount()
+        if actual != (self._image_count, self._text_count):
+            raise RuntimeError(f"Cached counts {(self._image_count, self._text_count)} do not match {actual} for {self}")
+
+    def _propagate_counts(self, images: int, texts: int) -> None:
+        node = self
+        while node is not None:
+            node._image_count += images
+            node._text_count += texts
+            node = node.parent
 
     def update_depth(self, depth: int) -> None:
-        # if self.depth == depth:
-        #     return
-        
+        # Depths inside a container only depend on the container's own depth,
+        # so moving the container shifts the whole subtree by the same amount
+        delta = depth - self.depth
+        if delta == 0:
+            return
+
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node.depth += delta
+            if isinstance(node, ContainerNode):
+                stack.extend(node.children)
+
+    def recompute_depth(self, depth: int) -> None:
+        # Full recomputation of the subtree depths, add_child keeps them up to date incrementally
         self.depth = depth
-        # for child in self.children:
-        #     # Increase depth of child if it is a container, else keep the same depth
-        #     new_depth = depth + 1 if isinstance(child, ContainerNode) else depth
-        #     child.update_depth(new_depth)
 
         if len(self.children) == 1 and isinstance(self.children[0], ContainerNode):
             # if only one child and it is a container, then keep the same depth
-            self.children[0].update_depth(depth)
+            self.children[0].recompute_depth(depth)
 
         else:
+            # texts indexed once instead of scanning all siblings for every image
+            texts = [child for child in self.children if isinstance(child, TextNode)]
+            text_index = SpatialIndex.build(texts, self.x, self.y, self.width, self.height) if len(texts) > 1 else None
             for child in self.children:
                 d = depth + 1
                 # for image check if some text is on top of it
                 if isinstance(child, ImageNode):
-                    for other in self.children:
-                        if isinstance(other, TextNode):
-                            if (other.x < child.x + child.width and
-                                other.x + other.width > child.x and
-                                other.y < child.y + child.height and
-                                other.y + other.height > child.y):
-                                # text overlaps with image, increase depth of image
-                                d = d + 1
-                                break
-                child.update_depth(d)
+                    if text_index is not None:
+                        covered = bool(text_index.query(child))
+                    else:
+                        covered = any(intersects(text, child) for text in texts)
+                    if covered:
+                        # text overlaps with image, increase depth of image
+                        d = d + 1
+                if isinstance(child, ContainerNode):
+                    child.recompute_depth(d)
+                else:
+                    child.update_depth(d)
 
     def _can_fit(self, child: LayoutNode) -> bool:
         return (self.x <= child.x and child.x + child.width <= self.x + self.width and
                 self.y <= child.y and child.y + child.height <= self.y + self.height)
 
+    def _overlapping_children(self, node: LayoutNode, kind: type) -> list:
+        if self._index is None and len(self.children) > SIBLING_INDEX_THRESHOLD:
+            self._index = SpatialIndex(self.x, self.y, self.width, self.height)
+            for child in self.children:
+                self._index.insert(child)
+
+        if self._index is not None:
+            return self._index.query(node, kind)
+        return [other for other in self.children if other is not node and isinstance(other, kind) and intersects(other, node)]
+
     def add_child(self, child: LayoutNode) -> None:
         # check if child can fit in container
         if not self._can_fit(child):
             raise ValueError(f"{child} does not fit in {self}")
 
-        # increase depth of child recursively
-        # new_depth = self.depth + 1 if isinstance(child, ContainerNode) else self.depth
-        # child.update_depth(new_depth)
+        if child.parent is not None:
+            child.parent.remove_child(child)
+
+        d = self.depth + 1
+        if not self.children:
+            # if only child and it is a container, then keep the same depth
+            if isinstance(child, ContainerNode):
+                d = self.depth
+        else:
+            if len(self.children) == 1 and isinstance(self.children[0], ContainerNode):
+                # the lone container child gets a sibling, so it moves one level down
+                self.children[0].update_depth(self.depth + 1)
+
+            if isinstance(child, ImageNode):
+                # for image check if some text is on top of it
+                if self._overlapping_children(child, TextNode):
+                    d = d + 1
+            elif isinstance(child, TextNode):
+                # images below the new text move one level down
+                for image in self._overlapping_children(child, ImageNode):
+                    image.update_depth(self.depth + 2)
+
+        child.update_depth(d)
+        child.parent = self
         self.children.append(child)
-        self.update_depth(self.depth)
+        if self._index is not None:
+            self._index.insert(child)
+        self._propagate_counts(child._image_count, child._text_count)
+
+    def remove_child(self, child: LayoutNode) -> None:
+        self.children.remove(child)
+        if self._index is not None:
+            self._index.remove(child)
+        child.parent = None
+        self._propagate_counts(-child._image_count, -child._text_count)
+
+        if len(self.children) == 1 and isinstance(self.children[0], ContainerNode):
+            # if only one child and it is a container, then keep the same depth
+            self.children[0].update_depth(self.depth)
+        elif isinstance(child, TextNode):
+            # images below the removed text move back up unless another text covers them
+            for image in self._overlapping_children(child, ImageNode):
+                if not self._overlapping_children(image, TextNode):
+                    image.update_depth(self.depth + 1)
 
     def __str__(self):
         return f"Container (x={self.x}, y={self.y}, {self.width}x{self.height}, depth={self.depth})" + "\n[\n" + "\n".join(str(child) for child in self.children) + "\n]"
@@ -126,6 +241,7 @@ class ContainerNode(LayoutNode):
         }
     
     def _draw_node(self, ax) -> None:
+        from matplotlib import patches
         rect = patches.Rectangle(
             (self.x, self.y),
             self.width,
@@ -142,7 +258,48 @@ class ContainerNode(LayoutNode):
         for child in self.children:
             child._draw_node(ax)
 
-    def save_image(self, path:str) -> None:
+    def _raster_node(self, canvas: np.ndarray, ox: int, oy: int, layer: int) -> None:
+        if self.depth == 0 and layer == RASTER_FRAME_LAYER:
+            import cv2
+            x, y = self.x - ox, self.y - oy
+            cv2.rectangle(canvas, (x, y), (x + self.width - 1, y + self.height - 1), (0, 0, 0), 3)
+
+        for child in self.children:
+            child._raster_node(canvas, ox, oy, layer)
+
+    @instrument.timed("render")
+    def render(self, draw_text: bool = True) -> np.ndarray:
+        """
+        Rasterize the layout into a BGR uint8 array of shape (height, width, 3).
+        Pixel (0, 0) is the top-left corner of this container, so node bboxes
+        from get_label() map 1:1 onto the returned array.
+
+        Parameters:
+        - draw_text: False leaves text nodes out, giving the layout with its text masked
+        """
+        canvas = np.full((self.height, self.width, 3), 255, dtype=np.uint8)
+        self._raster_node(canvas, self.x, self.y, RASTER_IMAGE_LAYER)
+        if draw_text:
+            self._raster_node(canvas, self.x, self.y, RASTER_TEXT_LAYER)
+        self._raster_node(canvas, self.x, self.y, RASTER_FRAME_LAYER)
+        return canvas
+
+    @instrument.timed("save_image")
+    def save_image(self, path:str, backend:str="raster") -> None:
+        if backend == "raster":
+            import cv2
+            img = self.render()
+            with instrument.timer("save_image.encode"):
+                if not cv2.imwrite(path, img):
+                    raise ValueError(f"Could not write image: {path}")
+        elif backend == "matplotlib":
+            with instrument.timer("save_image.matplotlib"):
+                self._save_image_matplotlib(path)
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+
+    def _save_image_matplotlib(self, path:str) -> None:
+        import matplotlib.pyplot as plt
         fw = 8
         fh = fw * self.height / self.width
         fig, ax = plt.subplots(figsize=(fw, fh))
@@ -151,6 +308,8 @@ class ContainerNode(LayoutNode):
         ax.invert_yaxis()
         ax.set_aspect("equal")
         ax.axis("off")
+        # fix the axes box now, text fitting converts data units to points with it
+        ax.apply_aspect()
 
         self._draw_node(ax)
         plt.savefig(path, bbox_inches='tight', pad_inches=0)
@@ -160,14 +319,15 @@ class ImageNode(LayoutNode):
     def __init__(self, x:int, y:int, width:int, height:int, image_path:str=""):
         super().__init__(x, y, width, height)
         self.image_path = image_path
+        self._image_count = 1
 
     @property
     def image_count(self):
-        return 1
+        return self._image_count
 
     @property
     def text_count(self):
-        return 0
+        return self._text_count
     
     def update_depth(self, depth:int):
         self.depth = depth
@@ -184,6 +344,8 @@ class ImageNode(LayoutNode):
         }
     
     def _draw_node(self, ax) -> None:
+        import cv2
+        from matplotlib import patches
         rect = patches.Rectangle(
             (self.x, self.y),
             self.width,
@@ -192,7 +354,7 @@ class ImageNode(LayoutNode):
         )
         ax.add_patch(rect)
 
-        img = cv2.imread(self.image_path)
+        img = load_image(self.image_path, self.width, self.height)
         if img is not None:
             img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
@@ -212,6 +374,29 @@ class ImageNode(LayoutNode):
         else:
             print(f"Could not read image: {self.image_path}")
 
+    def _raster_node(self, canvas: np.ndarray, ox: int, oy: int, layer: int) -> None:
+        if layer != RASTER_IMAGE_LAYER or self.width <= 0 or self.height <= 0:
+            return
+        import cv2
+
+        img = load_image(self.image_path, self.width, self.height)
+        if img is None:
+            print(f"Could not read image: {self.image_path}")
+            return
+
+        # Same placement as _draw_node: scale to cover the box keeping the aspect
+        # ratio, anchor at the top-left corner and clip. Only the visible part of
+        # the source is cropped out before resizing.
+        img_h, img_w = img.shape[:2]
+        scale = max(self.width / img_w, self.height / img_h)
+        crop_w = min(img_w, max(1, round(self.width / scale)))
+        crop_h = min(img_h, max(1, round(self.height / scale)))
+        interp = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        patch = cv2.resize(img[:crop_h, :crop_w], (self.width, self.height), interpolation=interp)
+
+        x, y = self.x - ox, self.y - oy
+        canvas[y:y + self.height, x:x + self.width] = patch
+
         # ax.text(
         #     self.x + self.width / 2,
         #     self.y + self.height / 2,
@@ -252,14 +437,15 @@ class TextNode(LayoutNode):
     ) -> None:
         super().__init__(x, y, width, height)
         self.text = text
+        self._text_count = 1
 
     @property
     def image_count(self) -> int:
-        return 0
+        return self._image_count
 
     @property
     def text_count(self) -> int:
-        return 1
+        return self._text_count
 
     def update_depth(self, depth: int) -> None:
         self.depth = depth
@@ -276,6 +462,8 @@ class TextNode(LayoutNode):
         }
     
     def _draw_node(self, ax) -> None:
+        from matplotlib import patches, patheffects
+        from matplotlib import font_manager as fm
         rect = patches.Rectangle(
             (self.x, self.y),
             self.width,
@@ -284,49 +472,107 @@ class TextNode(LayoutNode):
         )
         ax.add_patch(rect)
 
-        minfs, maxfs = 4, 24
-        fontsize = maxfs
+        fname = fm.findfont("Impact")
 
-        txt = ax.text(
+        # adjust font size to fit in box
+        # The fitter works in points, so convert the box from data units with the axes scale
+        fig = ax.figure
+        px_per_unit = abs(ax.transData.transform((1, 0))[0] - ax.transData.transform((0, 0))[0])
+        pt_per_unit = px_per_unit * 72 / fig.dpi
+        fontsize, lines = matplotlib_fitter(fname).fit(self.text, self.width * pt_per_unit, self.height * pt_per_unit)
+
+        ax.text(
             self.x + self.width / 2,
             self.y + self.height / 2,
-            self.text,
+            "\n".join(lines),
             ha = "center",
             va = "center",
             fontsize = fontsize,
             color = "white",
-            fontproperties = fm.FontProperties(fname=fm.findfont("Impact")),
+            fontproperties = fm.FontProperties(fname=fname, size=fontsize),
             path_effects=[
                 patheffects.Stroke(linewidth=3, foreground="black"),
                 patheffects.Normal(),
             ]
         )
 
-        # adjust font size to fit in box
-        # TODO: something wrong with width and height (0.75 is temporary fix)
-        # print(f"box_width: {width}, box_height: {height}")
-        renderer = ax.figure.canvas.get_renderer()
-        while fontsize >= minfs:
-            txt.set_fontsize(fontsize)
-            bbox = txt.get_window_extent(renderer=renderer)
-            inv = ax.transData.inverted()
-            bbox_data = bbox.transformed(inv)
-
-            text_width = abs(bbox_data.width)
-            text_height = abs(bbox_data.height)
-            # print(f"text_width: {text_width}, text_height: {text_height}")
-
-            # wrap text if too wide
-            if text_width > self.width * 0.9:
-                max_chars = max(1, int(len(self.text) * (self.width * 0.9) / text_width))
-                wrapped_text = "\n".join(textwrap.wrap(self.text, max_chars))
-                txt.set_text(wrapped_text)
-                bbox = txt.get_window_extent(renderer=renderer)
-                inv = ax.transData.inverted()
-                bbox_data = bbox.transformed(inv)
-                text_width = abs(bbox_data.width)
-                text_height = abs(bbox_data.height)
-
-            if text_width <= self.width * 0.9 and text_height <= self.height * 0.9:
-                break
-            fontsize -= 1
\ No newline at end of file
+    def _raster_node(self, canvas: np.ndarray, ox: int, oy: int, layer: int) -> None:
+        if layer != RASTER_TEXT_LAYER or not self.text:
+            return
+        import cv2
+
+        fontsize, lines = cv2_fitter(RASTER_FONT).fit(self.text, self.width, self.height)
+        scale = cv2_font_scale(RASTER_FONT, fontsize)
+        thickness = max(1, int(round(scale * 1.5)))
+        line_h = fontsize * 100 / 72 * 1.2
+
+        # Draw the glyphs into a mask over the box (plus a margin for overflowing text),
+        # then paint a dilated copy black for the outline and the mask itself white
+        pad = int(line_h)
+        x0, y0 = max(0, self.x - ox - pad), max(0, self.y - oy - pad)
+        x1 = min(canvas.shape[1], self.x - ox + self.width + pad)
+        y1 = min(canvas.shape[0], self.y - oy + self.height + pad)
+        if x1 <= x0 or y1 <= y0:
+            return
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+
+        cx = self.x - ox - x0 + self.width / 2
+        top = self.y - oy - y0 + (self.height - line_h * len(lines)) / 2
+        for i, line in enumerate(lines):
+            (lw, lh), _ = cv2.getTextSize(line, RASTER_FONT, scale, thickness)
+            org = (int(round(cx - lw / 2)), int(round(top + i * line_h + lh)))
+            cv2.putText(mask, line, org, RASTER_FONT, scale, 255, thickness, cv2.LINE_AA)
+
+        outline = cv2.dilate(mask, np.ones((3, 3), dtype=np.uint8), iterations=1)
+        roi = canvas[y0:y1, x0:x1]
+        roi[outline > 0] = 0
+        alpha = mask[..., None].astype(np.float32) / 255
+        roi[:] = (roi * (1 - alpha) + 255 * alpha).astype(np.uint8)
+
+def _text_on_image(a: LayoutNode, b: LayoutNode) -> bool:
+    # the only overlap a layout may contain: a caption placed over an image, or over a container of images only
+    if not isinstance(a, TextNode):
+        return False
+    return isinstance(b, ImageNode) or (isinstance(b, ContainerNode) and b.text_count == 0)
+
+def validate_layout(root: ContainerNode, check_depth: bool = True) -> list[str]:
+    """
+    Check a whole layout at once, indexing the children of every container a single time
+    instead of testing every pair of siblings.
+
+    Parameters:
+    - root: layout to check
+    - check_depth: also check that every depth is the one recompute_depth would assign
+
+    Returns:
+    - list of problems found, empty if the layout is valid:
+      children outside their container, overlapping siblings other than text on an
+      image, and (with check_depth) wrong depths
+    """
+    problems = []
+    stack = [(root, root.depth)]
+    while stack:
+        container, depth = stack.pop()
+        if check_depth and container.depth != depth:
+            problems.append(f"depth {container.depth} instead of {depth}: {container.get_label()['bbox']}")
+        children = container.children
+        index = SpatialIndex.build(children, container.x, container.y, container.width, container.height)
+
+        for child in children:
+            if not container._can_fit(child):
+                problems.append(f"outside its container: {type(child).__name__} {child.get_label()['bbox']}")
+        for a, b in index.find_overlaps(allowed=_text_on_image):
+            problems.append(f"overlap: {type(a).__name__} {a.get_label()['bbox']} and {type(b).__name__} {b.get_label()['bbox']}")
+
+        for child in children:
+            if len(children) == 1 and isinstance(child, ContainerNode):
+                d = depth
+            else:
+                d = depth + 1
+                if isinstance(child, ImageNode) and index.query(child, TextNode):
+                    d += 1
+            if isinstance(child, ContainerNode):
+                stack.append((child, d))
+            elif check_depth and child.depth != d:
+                problems.append(f"depth {child.depth} instead of {d}: {type(child).__name__} {child.get_label()['bbox']}")
+    return problems
@@ -0,0 +1,76 @@
+import os
+import mmap
+import numpy as np
+
+class PathIndex:
+    """
+    Read-only list of paths backed by two files that are memory-mapped on first use:
+    - <prefix>.blob: all paths, utf-8 encoded and concatenated
+    - <prefix>.offsets.npy: uint64 start offsets into the blob, plus the total length
+
+    Opening costs two mmaps regardless of the number of paths, paths are decoded only
+    when accessed, and worker processes share the pages through the OS page cache.
+    Pickling only sends the prefix, each process maps the files itself.
+    """
+    def __init__(self, prefix: str) -> None:
+        self.prefix = prefix
+        self._offsets = None
+        self._blob = None
+
+    @staticmethod
+    def exists(prefix: str) -> bool:
+        return os.path.exists(prefix + ".blob") and os.path.exists(prefix + ".offsets.npy")
+
+    @staticmethod
+    def build(prefix: str, paths) -> "PathIndex":
+        """ Write the index for an iterable of paths, atomically replacing any existing one """
+        offsets = [0]
+        tmp_blob = f"{prefix}.blob.{os.getpid()}.tmp"
+        tmp_offsets = f"{prefix}.offsets.{os.getpid()}.tmp.npy"
+        os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+        with open(tmp_blob, "wb") as f:
+            for path in paths:
+                data = path.encode()
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        np.save(tmp_offsets, np.array(offsets, dtype=np.uint64))
+        # offsets last: an index is only visible once both files are complete
+        os.replace(tmp_blob, prefix + ".blob")
+        os.replace(tmp_offsets, prefix + ".offsets.npy")
+        return PathIndex(prefix)
+
+    def _open(self) -> None:
+        self._offsets = np.load(self.prefix + ".offsets.npy", mmap_mode="r")
+        if self._offsets[-1] == 0:
+            # mmap cannot map an empty file
+            self._blob = b""
+            return
+        with open(self.prefix + ".blob", "rb") as f:
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            self._open()
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        offsets = self.offsets
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("path index out of range")
+        return self._blob[int(offsets[idx]):int(offsets[idx + 1])].decode()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getstate__(self) -> dict:
+        return {"prefix": self.prefix}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["prefix"])
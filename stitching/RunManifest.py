@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import hashlib
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _fsync_dir(path: str) -> None:
+    # makes a new or renamed file in path survive a crash, not supported on every platform
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class RunManifest:
+    """
+    Append-only record of the finished chunks of a generation run, one JSON object per line.
+
+    A chunk's record is appended only after all of its files are written: its layout ids,
+    seed range, path offset and the checksum file of its outputs (output_dir/.chunks/
+    <chunk>.sha256, in `sha256sum -c` format, relative to output_dir), together with the
+    digest of that checksum file. Every append is one write to an O_APPEND descriptor
+    followed by fsync, so after a crash the manifest holds every finished chunk and at
+    most one torn last line, which is ignored when the manifest is read.
+
+    Parameters:
+    - output_dir: run output directory, the manifest is output_dir/manifest.jsonl
+    """
+    def __init__(self, output_dir: str) -> None:
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, "manifest.jsonl")
+        self.chunks_dir = os.path.join(output_dir, ".chunks")
+
+    def records(self) -> dict[int, dict]:
+        """ Last record of every chunk in the manifest """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn write of an interrupted append
+                    continue
+                records[record["chunk"]] = record
+        return records
+
+    def _append(self, record: dict) -> None:
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # a torn last line must not swallow the record that follows it
+            size = os.fstat(fd).st_size
+            if size > 0 and os.pread(fd, 1, size - 1) != b"\n":
+                line = b"\n" + line
+            while line:
+                line = line[os.write(fd, line):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        if size == 0:
+            _fsync_dir(self.output_dir)
+
+    def checksum_path(self, chunk_id: int) -> str:
+        return os.path.join(self.chunks_dir, f"{chunk_id:06d}.sha256")
+
+    def record_chunk(self, chunk: dict, files: list[str], seed_range: tuple[int, int], **extra) -> dict:
+        """
+        Checksum the files of a finished chunk and append its record.
+
+        Parameters:
+        - chunk: chunk dict of the plan (id, start_id, count, path_offset)
+        - files: output files of the chunk, relative to output_dir
+        - seed_range: (first, last) layout seed of the chunk
+        - extra: anything else to keep in the record, e.g. the time it took
+        """
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        lines = "".join(f"{file_sha256(os.path.join(self.output_dir, name))}  {name}\n" for name in sorted(files))
+        checksum_path = self.checksum_path(chunk["id"])
+        with open(checksum_path + ".tmp", "w") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(checksum_path + ".tmp", checksum_path)
+        _fsync_dir(self.chunks_dir)
+
+        record = {
+            "chunk": chunk["id"],
+            "start_id": chunk["start_id"],
+            "count": chunk["count"],
+            "path_offset": chunk["path_offset"],
+            "seed_range": list(seed_range),
+            "shard": os.path.relpath(checksum_path, self.output_dir),
+            "files": len(files),
+            "sha256": hashlib.sha256(lines.encode()).hexdigest(),
+            "time": time.time(),
+            **extra,
+        }
+        self._append(record)
+        return record
+
+    def verify(self, record: dict, full: bool = False) -> list[tuple[str, str]]:
+        """
+        Problems with a recorded chunk as (file, problem) pairs: its checksum file is missing
+        or changed (then the file is the checksum file itself), or one of its files is
+        missing. With full, every file is also checksummed again.
+        """
+        checksum_path = os.path.join(self.output_dir, record["shard"])
+        if not os.path.exists(checksum_path):
+            return [(record["shard"], "missing")]
+        with open(checksum_path, "rb") as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != record["sha256"]:
+            return [(record["shard"], "does not match the manifest")]
+
+        problems = []
+        for line in data.decode().splitlines():
+            digest, name = line.split("  ", 1)
+            path = os.path.join(self.output_dir, name)
+            if not os.path.exists(path):
+                problems.append((name, "missing"))
+            elif full and file_sha256(path) != digest:
+                problems.append((name, "modified"))
+        return problems
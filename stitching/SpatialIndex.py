@@ -0,0 +1,108 @@
+import math
+
+def intersects(a, b) -> bool:
+    """ True if the bboxes of two nodes share any area (touching edges do not count) """
+    return (a.x < b.x + b.width and
+            a.x + a.width > b.x and
+            a.y < b.y + b.height and
+            a.y + a.height > b.y)
+
+class _Rect:
+    """ Query rectangle with the same x, y, width, height interface as a node """
+    __slots__ = ("x", "y", "width", "height")
+
+    def __init__(self, x: int, y: int, width: int, height: int) -> None:
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+class SpatialIndex:
+    """
+    Uniform grid over a rectangle. Each node (anything with x, y, width and height) is
+    stored in every cell its bbox touches, so a query only looks at the nodes in the
+    cells the query rect touches instead of at every node. Nodes outside the rectangle
+    are clamped into the border cells and still found.
+
+    Parameters:
+    - x, y, width, height: area covered by the grid, usually the container's bbox
+    - cells: number of cells along each side
+    """
+    def __init__(self, x: int, y: int, width: int, height: int, cells: int = 16) -> None:
+        self.x = x
+        self.y = y
+        self.cells = max(1, cells)
+        self.cell_w = max(1, -(-width // self.cells))
+        self.cell_h = max(1, -(-height // self.cells))
+        self.buckets: dict[tuple[int, int], list] = {}
+        self.size = 0
+
+    @classmethod
+    def build(cls, nodes: list, x: int, y: int, width: int, height: int) -> "SpatialIndex":
+        """ Index a fixed set of nodes, with about one node per cell """
+        index = cls(x, y, width, height, cells=min(64, math.isqrt(max(len(nodes), 1)) + 1))
+        for node in nodes:
+            index.insert(node)
+        return index
+
+    def _col(self, px: int) -> int:
+        return min(max((px - self.x) // self.cell_w, 0), self.cells - 1)
+
+    def _row(self, py: int) -> int:
+        return min(max((py - self.y) // self.cell_h, 0), self.cells - 1)
+
+    def _cells(self, node):
+        c0, c1 = self._col(node.x), self._col(node.x + max(node.width, 1) - 1)
+        r0, r1 = self._row(node.y), self._row(node.y + max(node.height, 1) - 1)
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                yield (r, c)
+
+    def insert(self, node) -> None:
+        for cell in self._cells(node):
+            self.buckets.setdefault(cell, []).append(node)
+        self.size += 1
+
+    def remove(self, node) -> None:
+        for cell in self._cells(node):
+            self.buckets[cell] = [other for other in self.buckets[cell] if other is not node]
+        self.size -= 1
+
+    def candidates(self, node) -> list:
+        """ Nodes sharing a cell with node, a superset of the ones it intersects """
+        found = {}
+        for cell in self._cells(node):
+            for other in self.buckets.get(cell, ()):
+                found[id(other)] = other
+        return list(found.values())
+
+    def query(self, rect, kind: type = None) -> list:
+        """
+        Nodes intersecting rect, which is a node or an (x, y, width, height) tuple,
+        optionally only those that are instances of kind. rect itself is never returned.
+        """
+        if isinstance(rect, tuple):
+            rect = _Rect(*rect)
+        return [other for other in self.candidates(rect)
+                if other is not rect and (kind is None or isinstance(other, kind)) and intersects(other, rect)]
+
+    def find_overlaps(self, allowed=None) -> list[tuple]:
+        """
+        All pairs of intersecting nodes, each reported once.
+
+        Parameters:
+        - allowed: optional callable (a, b) -> bool, pairs for which it returns True are left out
+        """
+        pairs = []
+        for (r, c), nodes in self.buckets.items():
+            for i, a in enumerate(nodes):
+                for b in nodes[i + 1:]:
+                    if not intersects(a, b):
+                        continue
+                    # a pair shares every cell its intersection touches, report it only in the cell of the intersection's top-left corner
+                    if (self._row(max(a.y, b.y)), self._col(max(a.x, b.x))) != (r, c):
+                        continue
+                    if allowed is not None and (allowed(a, b) or allowed(b, a)):
+                        continue
+                    pairs.append((a, b))
+        return pairs
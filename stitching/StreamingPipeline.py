@@ -0,0 +1,186 @@
+from GenerationEngine import GenerationEngine, GenerationTask
+from LayoutGenerator import seed_random
+from multiprocessing import Pool
+from tqdm import tqdm
+import os
+import sys
+import random
+import cv2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.yolo_formatter import process_node, write_labels, mask_text_from_label, write_dataset_yaml
+
+MASK_MODES = ("render", "labels", "ocr", "none")
+
+def generate_layouts(jobs):
+    """ Stage 1: build the layout of every (task, split) job """
+    for task, split in jobs:
+        seed_random(task.seed)
+        entry = task.entry
+        generator = entry.generator_cls(**entry.params)
+        layout = generator.generate(entry.width, entry.height, task.num_images, task.num_texts, task.paths)
+        yield task, split, layout
+
+def render_layouts(items, draw_text=True):
+    """ Stage 2: rasterize every layout, without its text if draw_text is False """
+    for task, split, layout in items:
+        yield task, split, layout, layout.render(draw_text=draw_text)
+
+def mask_text_ocr(items, recognizer):
+    """ Optional stage: mask the rendered text found by OCR, batch_size images per model call """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == recognizer.batch_size:
+            yield from _mask_batch(batch, recognizer)
+            batch = []
+    if batch:
+        yield from _mask_batch(batch, recognizer)
+
+def _mask_batch(batch, recognizer):
+    masked = recognizer.process_batch([img for *_, img in batch])
+    for (task, split, layout, _), (masked_img, _) in zip(batch, masked):
+        yield task, split, layout, masked_img
+
+def mask_text_labels(items, dilation=0):
+    """ Optional stage: paint the text boxes of the layout white, as the OCR stage would """
+    for task, split, layout, img in items:
+        yield task, split, layout, mask_text_from_label(img, layout.get_label(), dilation)
+
+def convert_labels(items):
+    """ Stage 3: YOLO boxes of the image nodes, straight from the layout tree """
+    for task, split, layout, img in items:
+        img_size = (img.shape[1], img.shape[0])  # (width, height)
+        yield task, split, img, process_node(layout.get_label(), img_size)
+
+def write_yolo(items, output_path, ext=".png"):
+    """ Stage 4: encode and write the YOLO image and label of every layout, label last """
+    for task, split, img, bboxes in items:
+        ok, buf = cv2.imencode(ext, img)
+        if not ok:
+            raise ValueError(f"Could not encode image for {task.name}")
+        image_dest = os.path.join(output_path, "images", split, task.name + ext)
+        with open(image_dest + ".tmp", "wb") as f:
+            f.write(buf.tobytes())
+        os.replace(image_dest + ".tmp", image_dest)
+        write_labels(os.path.join(output_path, "labels", split, f"{task.name}.txt"), bboxes)
+        yield task.name
+
+def run_jobs(jobs, output_path, mask_mode="render", recognizer=None, ext=".png", dilation=0):
+    """ Chain the stages over a list of (task, split) jobs, one layout in flight at a time """
+    items = generate_layouts(jobs)
+    items = render_layouts(items, draw_text=mask_mode != "render")
+    if mask_mode == "labels":
+        items = mask_text_labels(items, dilation)
+    elif mask_mode == "ocr":
+        items = mask_text_ocr(items, recognizer)
+    items = convert_labels(items)
+    return list(write_yolo(items, output_path, ext))
+
+# Pool workers get the output settings and their own recognizer once through the initializer
+_worker_args = None
+
+def _init_worker(output_path: str, mask_mode: str, recognizer_args: dict, ext: str, dilation: int) -> None:
+    global _worker_args
+    recognizer = None
+    if mask_mode == "ocr":
+        from text_recognition.TextRecognizer import TextRecognizer
+        recognizer = TextRecognizer(**recognizer_args)
+    _worker_args = (output_path, mask_mode, recognizer, ext, dilation)
+
+def _run_worker_jobs(jobs) -> list[str]:
+    return run_jobs(jobs, *_worker_args)
+
+class StreamingPipeline:
+    """
+    Generates layouts and writes them directly as a YOLO dataset.
+
+    Every layout goes through generate -> render -> (ocr) -> convert -> write in memory,
+    so the only files written are the final YOLO image and label, instead of a PNG and
+    JSON per layout that create_yolo_dataset reads back, decodes and OCRs again. Since
+    the generator knows where the text is, text is masked by default by not rendering
+    it at all (mask_mode="render"); "labels" paints white boxes over the text like
+    create_yolo_dataset does, "ocr" masks what easyocr finds and "none" keeps the text.
+
+    Tasks are planned by a GenerationEngine, so a run produces the same layouts for
+    any number of workers. Each layout's train/val split is drawn from its own seed, so it
+    does not depend on which other layouts are planned in the same run or chunk.
+
+    Parameters:
+    - recipe, paths, seed, start_id, path_offset, sampler: see GenerationEngine
+    - output_path: receives images/{train,val}, labels/{train,val} and macro_seg.yaml
+    - split_ratio: probability of a layout going to train
+    - mask_mode: "render", "labels", "ocr" or "none"
+    - dilation: pixels to grow text boxes by for mask_mode="labels"
+    - num_workers: pool size (defaults to os.cpu_count()), 1 runs in the calling process
+    - chunksize: jobs per pool task
+    - recognizer_args: TextRecognizer arguments for mask_mode="ocr"
+    - resume: skip layouts whose label file already exists
+    """
+    def __init__(
+        self,
+        recipe: list,
+        paths,
+        output_path: str,
+        split_ratio: float = 0.8,
+        mask_mode: str = "render",
+        num_workers: int = None,
+        seed: int = 0,
+        start_id: int = 1,
+        path_offset: int = 0,
+        sampler=None,
+        chunksize: int = 16,
+        recognizer_args: dict = None,
+        resume: bool = True,
+        ext: str = ".png",
+        dilation: int = 0
+    ) -> None:
+        if mask_mode not in MASK_MODES:
+            raise ValueError(f"Unknown mask mode: {mask_mode}")
+        self.engine = GenerationEngine(recipe, paths, output_path, num_workers=num_workers, seed=seed, start_id=start_id, path_offset=path_offset, sampler=sampler)
+        self.output_path = output_path
+        self.split_ratio = split_ratio
+        self.mask_mode = mask_mode
+        self.num_workers = self.engine.num_workers
+        self.seed = seed
+        self.chunksize = chunksize
+        self.recognizer_args = recognizer_args or {}
+        self.resume = resume
+        self.ext = ext
+        self.dilation = dilation
+
+    def plan(self) -> list[tuple[GenerationTask, str]]:
+        # a stream of its own, random.Random(task.seed) already draws the layout's image/text counts
+        split = lambda task: "train" if random.Random(f"split-{task.seed}").random() < self.split_ratio else "val"
+        return [(task, split(task)) for task in self.engine.plan()]
+
+    def is_done(self, job) -> bool:
+        task, split = job
+        return os.path.exists(os.path.join(self.output_path, "labels", split, f"{task.name}.txt"))
+
+    def run(self, jobs=None) -> list[str]:
+        if jobs is None:
+            jobs = self.plan()
+        for kind in ("images", "labels"):
+            for split in ("train", "val"):
+                os.makedirs(os.path.join(self.output_path, kind, split), exist_ok=True)
+        if self.resume:
+            pending = [job for job in jobs if not self.is_done(job)]
+            if len(pending) < len(jobs):
+                print(f"Resuming: {len(jobs) - len(pending)} of {len(jobs)} layouts already written.")
+            jobs = pending
+
+        names = []
+        chunks = [jobs[i:i + self.chunksize] for i in range(0, len(jobs), self.chunksize)]
+        init_args = (self.output_path, self.mask_mode, self.recognizer_args, self.ext, self.dilation)
+        if self.num_workers <= 1:
+            _init_worker(*init_args)
+            for chunk in tqdm(chunks):
+                names += _run_worker_jobs(chunk)
+        else:
+            with Pool(self.num_workers, initializer=_init_worker, initargs=init_args) as pool:
+                for chunk_names in tqdm(pool.imap_unordered(_run_worker_jobs, chunks), total=len(chunks)):
+                    names += chunk_names
+
+        write_dataset_yaml(self.output_path)
+        return names
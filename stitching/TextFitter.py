@@ -0,0 +1,162 @@
+from functools import lru_cache
+
+class FontMetrics:
+    """
+    Glyph advances and line heights of a font, per point of font size, in the units of the
+    boxes the text is fitted into. Each glyph is measured once by `measure` and then reused,
+    the width of a string is the sum of its advances times the font size.
+
+    Parameters:
+    - key: hashable name of the font, part of the fit cache key
+    - measure: callable returning the advance of one character per point
+    - line_height: height of a single line per point
+    - line_step: distance between consecutive baselines per point
+    """
+    def __init__(self, key, measure, line_height: float, line_step: float) -> None:
+        self.key = key
+        self.measure = measure
+        self.line_height = line_height
+        self.line_step = line_step
+        self._advances: dict[str, float] = {}
+
+    def advance(self, ch: str) -> float:
+        adv = self._advances.get(ch)
+        if adv is None:
+            adv = self._advances[ch] = self.measure(ch)
+        return adv
+
+    def width(self, text: str, fontsize: float) -> float:
+        return sum(self.advance(ch) for ch in text) * fontsize
+
+    def height(self, num_lines: int, fontsize: float) -> float:
+        return (self.line_height + self.line_step * (num_lines - 1)) * fontsize
+
+class TextFitter:
+    """
+    Finds the largest font size in [minfs, maxfs] at which the wrapped text fills at most
+    `fill` of the box in both directions, as the TextNode fitting loop did by rendering the
+    text at every size. The size is binary searched, text widths come from the glyph
+    advances, and results are cached per (text, box size), so repeated texts and box sizes
+    cost a dict lookup.
+    """
+    def __init__(self, metrics: FontMetrics, minfs: int = 4, maxfs: int = 24, fill: float = 0.9, cache_size: int = 65536) -> None:
+        self.metrics = metrics
+        self.minfs = minfs
+        self.maxfs = maxfs
+        self.fill = fill
+        self._fit = lru_cache(maxsize=cache_size)(self._solve)
+
+    def _wrap_word(self, word: str, fontsize: int, max_width: float) -> list[str]:
+        # break a word that is wider than a line into chunks, like textwrap's break_long_words
+        chunks, chunk, chunk_width = [], "", 0.0
+        for ch in word:
+            adv = self.metrics.advance(ch) * fontsize
+            if chunk and chunk_width + adv > max_width:
+                chunks.append(chunk)
+                chunk, chunk_width = "", 0.0
+            chunk += ch
+            chunk_width += adv
+        return chunks + [chunk]
+
+    def _layout(self, text: str, fontsize: int, width: float) -> tuple[list[str], float]:
+        """
+        Greedy word wrap against the measured line width. Unlike wrapping at a character
+        count this can only get better as the font shrinks, which keeps the search valid.
+        """
+        max_width = width * self.fill
+        space = self.metrics.advance(" ") * fontsize
+        lines, widths = [], []
+        line, line_width = "", 0.0
+        for word in text.split():
+            for part in self._wrap_word(word, fontsize, max_width):
+                part_width = self.metrics.width(part, fontsize)
+                if line and line_width + space + part_width <= max_width:
+                    line += " " + part
+                    line_width += space + part_width
+                    continue
+                if line:
+                    lines.append(line)
+                    widths.append(line_width)
+                line, line_width = part, part_width
+        if line or not lines:
+            lines.append(line)
+            widths.append(line_width)
+        return lines, max(widths)
+
+    def _fits(self, text: str, fontsize: int, width: float, height: float) -> tuple[bool, list[str]]:
+        lines, text_width = self._layout(text, fontsize, width)
+        text_height = self.metrics.height(len(lines), fontsize)
+        return text_width <= width * self.fill and text_height <= height * self.fill, lines
+
+    def _solve(self, text: str, width: float, height: float) -> tuple[int, tuple[str, ...]]:
+        fits, lines = self._fits(text, self.maxfs, width, height)
+        if fits:
+            return self.maxfs, tuple(lines)
+
+        # largest size that fits, minfs if none does
+        lo, hi = self.minfs, self.maxfs - 1
+        best = (self.minfs, tuple(self._layout(text, self.minfs, width)[0]))
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            fits, lines = self._fits(text, mid, width, height)
+            if fits:
+                best = (mid, tuple(lines))
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        return best
+
+    def fit(self, text: str, width: float, height: float) -> tuple[int, tuple[str, ...]]:
+        """
+        Returns:
+        - (fontsize, lines): font size in points and the wrapped lines
+        """
+        # round the box so that nearly identical boxes share cache entries
+        return self._fit(text, round(width, 1), round(height, 1))
+
+    def cache_info(self):
+        return self._fit.cache_info()
+
+# Fitters are kept per font for the lifetime of the process
+_fitters: dict = {}
+
+def cv2_fitter(font: int, dpi: int = 100) -> TextFitter:
+    """ Fitter for a cv2 Hershey font, boxes in pixels and font sizes in points at `dpi` """
+    key = ("cv2", font, dpi)
+    fitter = _fitters.get(key)
+    if fitter is None:
+        import cv2
+        (_, ref_h), ref_base = cv2.getTextSize("Ag", font, 1.0, 1)
+        px_per_pt = dpi / 72
+        # font scale that makes one line exactly 1pt high
+        unit_scale = px_per_pt / (ref_h + ref_base)
+        measure = lambda ch: cv2.getTextSize(ch, font, 1.0, 1)[0][0] * unit_scale
+        metrics = FontMetrics(key, measure, line_height=1.2 * px_per_pt, line_step=1.2 * px_per_pt)
+        fitter = _fitters[key] = TextFitter(metrics)
+    return fitter
+
+def cv2_font_scale(font: int, fontsize: float, dpi: int = 100) -> float:
+    import cv2
+    (_, ref_h), ref_base = cv2.getTextSize("Ag", font, 1.0, 1)
+    return fontsize * dpi / 72 / (ref_h + ref_base)
+
+def matplotlib_fitter(fname: str) -> TextFitter:
+    """ Fitter for a font file rendered by matplotlib, boxes and font sizes in points """
+    key = ("matplotlib", fname)
+    fitter = _fitters.get(key)
+    if fitter is None:
+        from matplotlib.figure import Figure
+        from matplotlib.font_manager import FontProperties
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        # measure with the Agg renderer at 72 dpi, where one pixel is one point
+        size = 100
+        fig = Figure(dpi=72)
+        renderer = FigureCanvasAgg(fig).get_renderer()
+        prop = FontProperties(fname=fname, size=size)
+        measure = lambda ch: renderer.get_text_width_height_descent(ch, prop, ismath=False)[0] / size
+        one_line = fig.text(0, 0, "lp", fontproperties=prop).get_window_extent(renderer).height / size
+        two_lines = fig.text(0, 0, "lp\nlp", fontproperties=prop).get_window_extent(renderer).height / size
+        metrics = FontMetrics(key, measure, line_height=one_line, line_step=two_lines - one_line)
+        fitter = _fitters[key] = TextFitter(metrics)
+    return fitter
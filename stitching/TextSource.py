@@ -0,0 +1,105 @@
+import os
+import numpy as np
+
+# Vocabulary file shared by every process, built from faker's word list on first use
+DEFAULT_VOCAB_PATH = os.environ.get("MACROSEG_TEXT_VOCAB", os.path.expanduser("~/.cache/macro_seg/text_vocab.npy"))
+BACKENDS = ("pool", "faker")
+
+def faker_words(locale: str = "en_US") -> list[str]:
+    """ The lorem word list of a faker locale, without building a Faker instance """
+    import importlib
+    provider = importlib.import_module(f"faker.providers.lorem.{locale}").Provider
+    return list(dict.fromkeys(provider.word_list))
+
+class TextSource:
+    """
+    Random word sequences for text nodes.
+
+    The "pool" backend samples words from a vocabulary stored as a fixed-width .npy array.
+    The file is memory mapped, so all workers share one copy through the page cache, and
+    many texts are sampled at once with a single NumPy draw. The "faker" backend calls
+    faker.words like random_text used to; faker is only imported when it is used.
+
+    Parameters:
+    - vocab_path: vocabulary .npy file, built from faker_words() if it does not exist
+    - backend: "pool" or "faker"
+    - seed: seed of the sampling RNG, see seed()
+    """
+    def __init__(self, vocab_path: str = None, backend: str = "pool", seed: int = None) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown text backend: {backend}")
+        self.vocab_path = vocab_path or DEFAULT_VOCAB_PATH
+        self.backend = backend
+        self._vocab = None
+        self._fake = None
+        self.seed(seed)
+
+    @staticmethod
+    def build(path: str, words: list[str]) -> None:
+        """ Write words as a vocabulary file, atomically so concurrent builders do not clash """
+        vocab = np.array([word for word in words if word], dtype=str)
+        if len(vocab) == 0:
+            raise ValueError("Empty vocabulary")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, vocab)
+        os.replace(tmp_path, path)
+
+    @property
+    def vocab(self) -> np.ndarray:
+        if self._vocab is None:
+            if not os.path.exists(self.vocab_path):
+                self.build(self.vocab_path, faker_words())
+            # a plain ndarray view of the map, indexing a np.memmap is noticeably slower
+            self._vocab = np.asarray(np.load(self.vocab_path, mmap_mode="r"))
+        return self._vocab
+
+    @property
+    def fake(self):
+        if self._fake is None:
+            import faker
+            self._fake = faker.Faker()
+            self._fake.seed_instance(self._seed)
+        return self._fake
+
+    def seed(self, seed: int = None) -> None:
+        self._seed = seed
+        self.rng = np.random.default_rng(seed)
+        if self._fake is not None:
+            self._fake.seed_instance(seed)
+
+    def getstate(self) -> tuple:
+        """ State of the sampling RNGs, like random.getstate(), for setstate() """
+        return self._seed, self.rng.bit_generator.state, self._fake.random.getstate() if self._fake is not None else None
+
+    def setstate(self, state: tuple) -> None:
+        self._seed, rng_state, fake_state = state
+        self.rng = np.random.default_rng()
+        self.rng.bit_generator.state = rng_state
+        if fake_state is None:
+            # faker was not used yet, it will be seeded with _seed when it is
+            self._fake = None
+        else:
+            self.fake.random.setstate(fake_state)
+
+    def text(self, min_words: int = 2, max_words: int = 5) -> str:
+        if self.backend == "faker":
+            return " ".join(self.fake.words(nb=int(self.rng.integers(min_words, max_words + 1))))
+        # one draw for both the word count and the words, the per call overhead dominates here
+        vocab = self.vocab
+        u = self.rng.random(max_words + 1)
+        cnt = min_words + int(u[0] * (max_words - min_words + 1))
+        return " ".join(vocab[(u[1:cnt + 1] * len(vocab)).astype(np.intp)].tolist())
+
+    def texts(self, n: int, min_words: int = 2, max_words: int = 5, rng: np.random.Generator = None) -> list[str]:
+        """ n texts of min_words to max_words words each, drawn from rng (this source's by default) """
+        rng = rng if rng is not None else self.rng
+        counts = rng.integers(min_words, max_words + 1, n)
+        if self.backend == "faker":
+            return [" ".join(self.fake.words(nb=int(cnt))) for cnt in counts]
+        words = self.vocab[rng.integers(0, len(self.vocab), int(counts.sum()))].tolist()
+        ends = np.cumsum(counts).tolist()
+        return [" ".join(words[end - cnt:end]) for cnt, end in zip(counts.tolist(), ends)]
+
+# Module level source used by random_text, MACROSEG_TEXT_BACKEND=faker switches back to faker
+text_source = TextSource(backend=os.environ.get("MACROSEG_TEXT_BACKEND", "pool"))
@@ -0,0 +1,106 @@
+import os
+import mmap
+import struct
+import zipfile
+import threading
+
+# Image paths of the form "<archive>.zip::<member>" are read from inside the archive
+ZIP_SEPARATOR = "::"
+
+# fixed part of a zip local file header, followed by the name and extra field
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_LOCAL_HEADER_SIG = b"PK\x03\x04"
+
+def zip_uri(archive: str, member: str) -> str:
+    return f"{archive}{ZIP_SEPARATOR}{member}"
+
+def is_zip_uri(path: str) -> bool:
+    return ZIP_SEPARATOR in path
+
+def split_zip_uri(uri: str) -> tuple[str, str]:
+    archive, member = uri.split(ZIP_SEPARATOR, 1)
+    return archive, member
+
+class _Archive:
+    """ An open archive: the ZipFile, a read-only mmap of the file and its member index """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        self.members = {info.filename: info for info in self.zip.infolist() if not info.is_dir()}
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # zipfile keeps a single file position, decompressing reads take turns
+        self.lock = threading.Lock()
+
+    def data_offset(self, info: zipfile.ZipInfo) -> int:
+        header = _LOCAL_HEADER.unpack_from(self.map, info.header_offset)
+        if header[0] != _LOCAL_HEADER_SIG:
+            raise zipfile.BadZipFile(f"Bad local header for {info.filename} in {self.path}")
+        name_len, extra_len = header[-2], header[-1]
+        return info.header_offset + _LOCAL_HEADER.size + name_len + extra_len
+
+    def read(self, member: str) -> "bytes | memoryview":
+        info = self.members.get(member)
+        if info is None:
+            raise KeyError(f"{member} not found in {self.path}")
+        if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+            # stored members are a plain byte range of the archive, no copy needed
+            start = self.data_offset(info)
+            return memoryview(self.map)[start:start + info.file_size]
+        with self.lock:
+            return self.zip.read(info)
+
+    def close(self) -> None:
+        self.zip.close()
+        self.map.close()
+
+class ZipImageSource:
+    """
+    Reads image files straight out of zip archives instead of extracting them.
+
+    Each archive is opened once per process, its central directory is kept as a member
+    index, and members are read on demand: stored (uncompressed) members, which is how
+    image archives are usually packed, are sliced out of a memory map of the archive,
+    compressed ones are inflated through zipfile. Archives are reopened after a fork so
+    worker processes never share file positions.
+    """
+    def __init__(self) -> None:
+        self._archives: dict[str, _Archive] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def archive(self, path: str) -> _Archive:
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._pid != os.getpid():
+                # inherited from the parent process, the handles are not ours to use
+                self._archives = {}
+                self._pid = os.getpid()
+            archive = self._archives.get(path)
+            if archive is None:
+                archive = self._archives[path] = _Archive(path)
+            return archive
+
+    def members(self, path: str, extensions: tuple[str, ...] = None) -> list[str]:
+        """ Member names of an archive, optionally only those with one of the extensions """
+        names = sorted(self.archive(path).members)
+        if extensions is not None:
+            names = [name for name in names if name.lower().endswith(extensions)]
+        return names
+
+    def read(self, uri: str) -> "bytes | memoryview":
+        """ Encoded bytes of the member named by an "<archive>::<member>" uri """
+        archive, member = split_zip_uri(uri)
+        return self.archive(archive).read(member)
+
+    def close(self) -> None:
+        with self._lock:
+            for archive in self._archives.values():
+                archive.close()
+            self._archives = {}
+
+# Process-wide source used by the image cache
+zip_source = ZipImageSource()
+
+def read_zip_member(uri: str) -> "bytes | memoryview":
+    return zip_source.read(uri)
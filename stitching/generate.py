@@ -0,0 +1,390 @@
+"""
+Generate layouts from a recipe file, in restartable chunks.
+
+    python generate.py plan recipes/default.yaml
+    python generate.py estimate recipes/default.yaml --calibrate 50
+    python generate.py run recipes/default.yaml --workers 8
+
+A recipe (YAML or JSON) describes the whole run:
+
+    seed: 0
+    total: 1000000          # split over the layouts by weight, or give each layout a count
+    format: yolo            # yolo (StreamingPipeline), json or store (GenerationEngine)
+    workers: 8
+    chunk_size: 10000
+    output: ../runs/v1      # relative paths are relative to the recipe file
+    images: {dir: ../dataset, source: local}
+    sizes: [[800, 600]]     # default canvas sizes, a layout's count is split evenly over them
+    layouts:
+      - generator: GridLayoutGenerator
+        params: {rows: 2, cols: 3, spacing: 10}
+        weight: 3
+        num_images: [3, 6]  # int or inclusive [min, max], drawn per layout
+        num_texts: [0, 3]
+
+Chunks are consecutive ranges of layout ids. Each is planned from the recipe alone (seed,
+ids and the image path offset at its first layout), so every chunk produces the same
+layouts whether it runs first, last or on its own. Finished chunks are appended to
+output/manifest.jsonl with their seed range and the checksums of their files (see
+RunManifest), and a restarted run skips them.
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import LayoutGenerator
+from GenerationEngine import GenerationEngine, RecipeEntry
+from StreamingPipeline import StreamingPipeline, MASK_MODES
+from RunManifest import RunManifest
+
+FORMATS = ("yolo", "json", "store")
+DEFAULTS = {
+    "seed": 0,
+    "start_id": 1,
+    "total": None,
+    "format": "yolo",
+    "workers": None,
+    "chunk_size": 10000,
+    "output": "output",
+    "images": {"dir": "../dataset", "source": "local"},
+    "sizes": [[800, 600]],
+    "split_ratio": 0.8,
+    "mask_mode": "render",
+    "ext": ".png",
+    "dilation": 0,
+    "backend": "raster",
+}
+
+def load_recipe(path: str) -> dict:
+    """ Read a YAML or JSON recipe, fill in the defaults and resolve its paths """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            recipe = yaml.safe_load(f)
+        else:
+            recipe = json.load(f)
+
+    unknown = set(recipe) - set(DEFAULTS) - {"layouts"}
+    if unknown:
+        raise ValueError(f"Unknown recipe keys: {', '.join(sorted(unknown))}")
+    if not recipe.get("layouts"):
+        raise ValueError("Recipe has no layouts")
+    recipe = {**DEFAULTS, **recipe}
+    if recipe["format"] not in FORMATS:
+        raise ValueError(f"Unknown output format: {recipe['format']}")
+    if recipe["mask_mode"] not in MASK_MODES:
+        raise ValueError(f"Unknown mask mode: {recipe['mask_mode']}")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    recipe["output"] = os.path.normpath(os.path.join(base_dir, recipe["output"]))
+    recipe["images"] = {**recipe["images"], "dir": os.path.normpath(os.path.join(base_dir, recipe["images"]["dir"]))}
+    return recipe
+
+def _split(total: int, weights: list) -> list[int]:
+    # largest remainder: integer counts proportional to weights that add up to total
+    exact = [total * w / sum(weights) for w in weights]
+    counts = [int(x) for x in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: counts[i] - exact[i])
+    for i in by_remainder[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+def recipe_entries(recipe: dict) -> list[RecipeEntry]:
+    """ One RecipeEntry per (layout, canvas size) of the recipe, with its layout count """
+    layouts = recipe["layouts"]
+    if recipe["total"] is not None:
+        if any("count" in layout for layout in layouts):
+            raise ValueError("Give either a recipe total with layout weights or a count per layout")
+        counts = _split(recipe["total"], [layout.get("weight", 1) for layout in layouts])
+    else:
+        if not all("count" in layout for layout in layouts):
+            raise ValueError("Every layout needs a count when the recipe has no total")
+        counts = [layout["count"] for layout in layouts]
+
+    entries = []
+    for layout, count in zip(layouts, counts):
+        generator_cls = getattr(LayoutGenerator, layout["generator"], None)
+        if not isinstance(generator_cls, type):
+            raise ValueError(f"Unknown generator: {layout['generator']}")
+        sizes = layout.get("sizes", recipe["sizes"])
+        name = layout.get("name", layout["generator"])
+        num_images, num_texts = layout.get("num_images", 1), layout.get("num_texts", 0)
+        for (width, height), size_count in zip(sizes, _split(count, [1] * len(sizes))):
+            entries.append(RecipeEntry(
+                generator_cls,
+                params=layout.get("params"),
+                count=size_count,
+                width=width,
+                height=height,
+                num_images=num_images if isinstance(num_images, int) else tuple(num_images),
+                num_texts=num_texts if isinstance(num_texts, int) else tuple(num_texts),
+                name=name if len(sizes) == 1 else f"{name}_{width}x{height}"
+            ))
+    return entries
+
+def plan_chunks(recipe: dict, entries: list[RecipeEntry]) -> list[dict]:
+    """
+    Split the run into chunks of chunk_size consecutive layout ids.
+
+    Returns:
+    - chunks: dicts with the chunk id, its first layout id, layout count, the path offset at
+              its first layout and its (entry index, count) parts
+    """
+    # counts are drawn from the layout seeds exactly as GenerationEngine.plan does
+    engine = GenerationEngine(entries, [None], recipe["output"], num_workers=1, seed=recipe["seed"])
+    chunk_size = recipe["chunk_size"]
+    chunks = []
+    layout_id, cursor = recipe["start_id"], 0
+    for index, entry in enumerate(entries):
+        remaining = entry.count
+        while remaining > 0:
+            if not chunks or chunks[-1]["count"] == chunk_size:
+                chunks.append({"id": len(chunks), "start_id": layout_id, "count": 0, "path_offset": cursor, "parts": []})
+            chunk = chunks[-1]
+            take = min(remaining, chunk_size - chunk["count"])
+            chunk["parts"].append((index, take))
+            chunk["count"] += take
+            if isinstance(entry.num_images, int):
+                cursor += take * entry.num_images
+            else:
+                cursor += sum(engine.draw_counts(entry, layout_id + k)[0] for k in range(take))
+            layout_id += take
+            remaining -= take
+    for chunk in chunks:
+        chunk["images"] = (chunks[chunk["id"] + 1]["path_offset"] if chunk["id"] + 1 < len(chunks) else cursor) - chunk["path_offset"]
+    return chunks
+
+def _chunk_entries(entries: list[RecipeEntry], chunk: dict) -> list[RecipeEntry]:
+    return [RecipeEntry(entries[index].generator_cls, entries[index].params, count, entries[index].width, entries[index].height,
+                        entries[index].num_images, entries[index].num_texts, entries[index].name)
+            for index, count in chunk["parts"]]
+
+def _chunk_runner(recipe: dict, entries: list[RecipeEntry], chunk: dict, paths, output_path: str, workers: int):
+    # the StreamingPipeline or GenerationEngine that writes the chunk
+    chunk_entries = _chunk_entries(entries, chunk)
+    if recipe["format"] == "yolo":
+        return StreamingPipeline(
+            chunk_entries, paths, output_path,
+            split_ratio=recipe["split_ratio"],
+            mask_mode=recipe["mask_mode"],
+            num_workers=workers,
+            seed=recipe["seed"],
+            start_id=chunk["start_id"],
+            path_offset=chunk["path_offset"],
+            ext=recipe["ext"],
+            dilation=recipe["dilation"]
+        )
+    return GenerationEngine(
+        chunk_entries, paths, output_path,
+        num_workers=workers,
+        seed=recipe["seed"],
+        start_id=chunk["start_id"],
+        path_offset=chunk["path_offset"],
+        backend=recipe["backend"],
+        label_format=recipe["format"]
+    )
+
+def run_chunk(recipe: dict, entries: list[RecipeEntry], chunk: dict, paths, output_path: str, workers: int) -> list[str]:
+    return _chunk_runner(recipe, entries, chunk, paths, output_path, workers).run()
+
+def chunk_files(recipe: dict, runner) -> list[str]:
+    """
+    Output files of a chunk relative to the output directory. Labels of the "store" format
+    go to label store shards shared by all chunks and are not part of any chunk.
+    """
+    if recipe["format"] == "yolo":
+        return [name for task, split in runner.plan() for name in
+                (f"images/{split}/{task.name}{recipe['ext']}", f"labels/{split}/{task.name}.txt")]
+    files = [f"images/{task.name}.png" for task in runner.plan()]
+    if recipe["format"] == "json":
+        files += [f"jsons/{task.name}.json" for task in runner.plan()]
+    return files
+
+def repair_partial(recipe: dict, runner, output_path: str) -> int:
+    """
+    Check the layouts an interrupted yolo chunk already wrote, before it resumes. A label
+    only counts as done if its image exists and decodes (a file renamed into place but not
+    yet flushed can come back empty after a crash), otherwise both are removed and the
+    layout is generated again. Returns the number of layouts removed.
+    """
+    import cv2
+    removed = 0
+    for task, split in runner.plan():
+        image_path = os.path.join(output_path, "images", split, task.name + recipe["ext"])
+        label_path = os.path.join(output_path, "labels", split, f"{task.name}.txt")
+        for tmp_path in (image_path + ".tmp", label_path + ".tmp"):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if not os.path.exists(label_path):
+            continue
+        if os.path.exists(image_path) and cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_8) is not None:
+            continue
+        for path in (image_path, label_path):
+            if os.path.exists(path):
+                os.remove(path)
+        removed += 1
+    return removed
+
+def load_paths(recipe: dict):
+    # images: dir plus any other CustomDataset arguments (source, index_path, extract)
+    from DataLoader import CustomDataset
+    images = dict(recipe["images"])
+    return CustomDataset(images.pop("dir"), **images)
+
+def _dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def calibrate(recipe: dict, entries: list[RecipeEntry], paths, count: int) -> dict:
+    """
+    Run about `count` layouts, drawn from the entries in proportion to their counts, into a
+    temporary directory with a single worker and measure time and disk per layout.
+    """
+    total = sum(entry.count for entry in entries)
+    sample = [max(1, c) for c in _split(count, [entry.count for entry in entries])]
+    chunk = {"start_id": recipe["start_id"], "path_offset": 0,
+             "parts": [(index, n) for index, n in enumerate(sample) if entries[index].count > 0]}
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        names = run_chunk(recipe, entries, chunk, paths, tmp, workers=1)
+        seconds = time.perf_counter() - start
+        size = _dir_bytes(tmp)
+    return {
+        "layouts": len(names),
+        "seconds_per_layout": seconds / len(names),
+        "bytes_per_layout": size / len(names),
+        "total_layouts": total,
+    }
+
+def _format_seconds(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m{seconds % 60:02d}s"
+
+def _format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+def _print_plan(recipe: dict, entries: list[RecipeEntry], chunks: list[dict]) -> None:
+    print(f"{'layout':<40}{'size':>12}{'count':>12}{'images':>12}{'texts':>12}")
+    for entry in entries:
+        print(f"{entry.name:<40}{f'{entry.width}x{entry.height}':>12}{entry.count:>12}{str(entry.num_images):>12}{str(entry.num_texts):>12}")
+    total = sum(chunk["count"] for chunk in chunks)
+    images = sum(chunk["images"] for chunk in chunks)
+    print(f"{total} layouts using {images} source images in {len(chunks)} chunks of up to {recipe['chunk_size']}, "
+          f"format {recipe['format']}, seed {recipe['seed']}, output {recipe['output']}")
+
+def _select_chunks(chunks: list[dict], spec: str) -> list[dict]:
+    # "3", "0-9" or "0-9,20-29", to spread one run over several machines
+    if spec is None:
+        return chunks
+    ids = set()
+    for part in spec.split(","):
+        lo, _, hi = part.partition("-")
+        ids.update(range(int(lo), int(hi or lo) + 1))
+    return [chunk for chunk in chunks if chunk["id"] in ids]
+
+def run(recipe: dict, entries: list[RecipeEntry], chunks: list[dict], workers: int, spec: str = None, force: bool = False, verify: bool = False) -> None:
+    """
+    Run the selected chunks that the manifest does not list as finished. Finished chunks are
+    checked against their checksum files first (every file is re-hashed with verify) and run
+    again if anything is missing or changed; an interrupted yolo chunk resumes after
+    repair_partial.
+    """
+    output_path = recipe["output"]
+    os.makedirs(output_path, exist_ok=True)
+
+    # the chunk plan is only valid for the recipe it came from
+    plan_path = os.path.join(output_path, "plan.json")
+    plan = {"recipe": recipe, "chunks": [{k: v for k, v in chunk.items() if k != "parts"} for chunk in chunks]}
+    if os.path.exists(plan_path) and not force:
+        with open(plan_path) as f:
+            if json.load(f)["recipe"] != json.loads(json.dumps(recipe)):
+                raise ValueError(f"{output_path} was planned from a different recipe, use another output or --force")
+    with open(plan_path + ".tmp", "w") as f:
+        json.dump(plan, f, indent=2)
+    os.replace(plan_path + ".tmp", plan_path)
+
+    manifest = RunManifest(output_path)
+    records = manifest.records()
+    selected = _select_chunks(chunks, spec)
+    pending, stale = [], {}
+    for chunk in selected:
+        record = records.get(chunk["id"])
+        problems = manifest.verify(record, full=verify) if record is not None else None
+        if problems:
+            print("\n".join(f"chunk {chunk['id']}: {name} {problem}" for name, problem in problems[:10]))
+            print(f"Running chunk {chunk['id']} again.")
+            # without a trustworthy checksum file none of the chunk's files can be trusted
+            stale[chunk["id"]] = None if problems[0][0] == record["shard"] else [name for name, _ in problems]
+        if problems is None or problems:
+            pending.append(chunk)
+    if len(pending) < len(selected):
+        print(f"Resuming: {len(selected) - len(pending)} of {len(selected)} chunks already done.")
+
+    paths = load_paths(recipe)
+    engine = GenerationEngine(entries, [None], output_path, seed=recipe["seed"])
+    for n, chunk in enumerate(pending):
+        print(f"Chunk {chunk['id']} ({n + 1}/{len(pending)}): layouts {chunk['start_id']}..{chunk['start_id'] + chunk['count'] - 1}")
+        runner = _chunk_runner(recipe, entries, chunk, paths, output_path, workers)
+        if chunk["id"] in stale:
+            names = stale[chunk["id"]]
+            for name in names if names is not None else chunk_files(recipe, runner):
+                if os.path.exists(os.path.join(output_path, name)):
+                    os.remove(os.path.join(output_path, name))
+        if recipe["format"] == "yolo":
+            removed = repair_partial(recipe, runner, output_path)
+            if removed:
+                print(f"Removed {removed} partially written layouts.")
+        start = time.perf_counter()
+        runner.run()
+        seed_range = (engine.task_seed(chunk["start_id"]), engine.task_seed(chunk["start_id"] + chunk["count"] - 1))
+        manifest.record_chunk(chunk, chunk_files(recipe, runner), seed_range, seconds=time.perf_counter() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("plan", "estimate", "run"))
+    parser.add_argument("recipe", help="YAML or JSON recipe file")
+    parser.add_argument("--output", help="output directory, overrides the recipe")
+    parser.add_argument("--workers", type=int, help="worker processes, overrides the recipe")
+    parser.add_argument("--seed", type=int, help="run seed, overrides the recipe")
+    parser.add_argument("--chunks", help="only run these chunk ids, e.g. 0-9,20")
+    parser.add_argument("--calibrate", type=int, default=20, help="layouts to generate for the estimate")
+    parser.add_argument("--force", action="store_true", help="run even if the output was planned from another recipe")
+    parser.add_argument("--verify", action="store_true", help="re-hash the files of finished chunks before skipping them")
+    args = parser.parse_args(argv)
+
+    recipe = load_recipe(args.recipe)
+    if args.output is not None:
+        recipe["output"] = os.path.abspath(args.output)
+    if args.seed is not None:
+        recipe["seed"] = args.seed
+    workers = args.workers or recipe["workers"] or os.cpu_count()
+
+    entries = recipe_entries(recipe)
+    chunks = plan_chunks(recipe, entries)
+    _print_plan(recipe, entries, chunks)
+
+    if args.command == "estimate":
+        paths = load_paths(recipe)
+        result = calibrate(recipe, entries, paths, args.calibrate)
+        total = result["total_layouts"]
+        # pool workers scale about linearly up to the number of cores
+        seconds = result["seconds_per_layout"] * total / min(workers, os.cpu_count())
+        size = result["bytes_per_layout"] * total
+        print(f"Calibration: {result['layouts']} layouts, {1000 * result['seconds_per_layout']:.1f}ms "
+              f"and {_format_bytes(result['bytes_per_layout'])} per layout")
+        existing = recipe["output"]
+        while not os.path.exists(existing):
+            existing = os.path.dirname(existing)
+        free = shutil.disk_usage(existing).free
+        print(f"Estimate with {workers} workers: {_format_seconds(seconds)}, {_format_bytes(size)} on disk "
+              f"({_format_bytes(free)} free)")
+    elif args.command == "run":
+        run(recipe, entries, chunks, workers, args.chunks, args.force, args.verify)
+
+if __name__ == "__main__":
+    main()
@@ -264,19 +264,20 @@ def draw_layouts():
             visualize_layout(os.path.join("jsons", json_file), f"images/{id}_{json_file.replace('.json', '.png')}")
             print(json_file)
 
-dataset = CustomDataset("../dataset")
-os.makedirs("images", exist_ok=True)
-os.makedirs("jsons", exist_ok=True)
-sample_layout()
-test_layout_node()
-
-num_iter = 5000
-for _ in range(num_iter):
-    test_single_image_layouts()
-    test_grid_layouts()
-    test_text_on_image_layouts()
-    test_asymmetrical_layouts()
-    print(f"{(_+1)*100/num_iter:<.2f}% done")
-# draw_layouts()
-
-print(f"{id-1} images and JSONs generated.")
\ No newline at end of file
+if __name__ == "__main__":
+    dataset = CustomDataset("../dataset")
+    os.makedirs("images", exist_ok=True)
+    os.makedirs("jsons", exist_ok=True)
+    sample_layout()
+    test_layout_node()
+
+    num_iter = 5000
+    for _ in range(num_iter):
+        test_single_image_layouts()
+        test_grid_layouts()
+        test_text_on_image_layouts()
+        test_asymmetrical_layouts()
+        print(f"{(_+1)*100/num_iter:<.2f}% done")
+    # draw_layouts()
+
+    print(f"{id-1} images and JSONs generated.")
\ No newline at end of file
@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+import numpy as np
+
+# the stitching modules import each other by file name, utils and text_recognition are packages of the root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "stitching")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+@pytest.fixture
+def image_dir(tmp_path):
+    """ Six small JPEGs of assorted sizes in two sub-datasets """
+    cv2 = pytest.importorskip("cv2")
+    rng = np.random.default_rng(0)
+    root = tmp_path / "images"
+    for i, (w, h) in enumerate([(64, 48), (96, 64), (48, 80), (120, 90), (80, 80), (100, 60)]):
+        folder = root / ("a" if i % 2 else "b")
+        folder.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(folder / f"{i}.jpg"), rng.integers(0, 255, (h, w, 3), dtype=np.uint8))
+    return root
@@ -0,0 +1,47 @@
+import pytest
+import numpy as np
+
+from ImageCache import ImageCache, image_size, pick_level
+
+cv2 = pytest.importorskip("cv2")
+
+@pytest.fixture
+def photo(tmp_path):
+    rng = np.random.default_rng(2)
+    yy, xx = np.mgrid[0:600, 0:800]
+    img = np.stack([xx * 255 // 800, yy * 255 // 600, (xx + yy) * 255 // 1400], axis=-1)
+    path = str(tmp_path / "photo.jpg")
+    cv2.imwrite(path, np.clip(img + rng.integers(-30, 30, img.shape), 0, 255).astype(np.uint8))
+    return path
+
+def test_level_depends_on_the_box_only(photo):
+    assert image_size(photo) == (800, 600)
+    assert image_size(photo + ".missing") is None
+    assert [pick_level((800, 600), w, h) for w, h in [(800, 600), (400, 300), (399, 100), (90, 60), (None, None)]] == [1, 2, 2, 8, 1]
+
+def test_same_box_gives_the_same_pixels_whatever_was_cached(photo):
+    fresh = ImageCache().get(photo, 190, 140)
+
+    # a larger level cached first must not be served for a smaller box
+    cache = ImageCache()
+    full = cache.get(photo, 800, 600)
+    assert full.shape[:2] == (600, 800)
+    np.testing.assert_array_equal(cache.get(photo, 190, 140), fresh)
+    assert cache.stats()["entries"] == 2
+
+    # nor may a decode after an eviction differ
+    cache = ImageCache(max_bytes=fresh.nbytes)
+    cache.get(photo, 190, 140)
+    cache.get(photo, 90, 60)
+    assert list(cache._entries) == [(photo, 8)]
+    np.testing.assert_array_equal(cache.get(photo, 190, 140), fresh)
+
+def test_eviction_prunes_sizes(photo, image_dir):
+    cache = ImageCache(max_bytes=2 * 120 * 90 * 3)
+    paths = sorted(str(p) for p in image_dir.rglob("*.jpg"))
+    for path in paths:
+        cache.get(path)
+    assert set(cache._sizes) == {path for path, _ in cache._entries}
+    assert cache.bytes == sum(img.nbytes for img in cache._entries.values()) <= cache.max_bytes
+    cache.clear()
+    assert cache._sizes == {} and cache.bytes == 0
@@ -0,0 +1,33 @@
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYOUT_MODULES = ("LayoutNode", "LayoutGenerator", "LayoutArray", "GenerationEngine")
+HEAVY_MODULES = ("cv2", "matplotlib", "faker", "easyocr", "torch")
+# seconds, median over a few fresh interpreters
+IMPORT_BUDGET = 0.3
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+{imports}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def import_layout_modules():
+    code = PROBE.format(imports="\n".join(f"import {name}" for name in LAYOUT_MODULES), heavy=HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, "stitching")]))
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.splitlines()[-1])
+
+def test_layout_modules_do_not_load_heavy_dependencies():
+    assert import_layout_modules()["loaded"] == []
+
+def test_layout_modules_import_within_budget():
+    # the first run also warms the bytecode cache
+    times = [import_layout_modules()["seconds"] for _ in range(4)][1:]
+    assert statistics.median(times) <= IMPORT_BUDGET
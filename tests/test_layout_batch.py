@@ -0,0 +1,36 @@
+import random
+import numpy as np
+import pytest
+
+from LayoutArray import NODE_TEXT
+from LayoutGenerator import SingleImageLayoutGenerator, GridLayoutGenerator, TextOnImageLayoutGenerator
+from TextSource import text_source
+
+GENERATORS = [
+    (SingleImageLayoutGenerator, {}, 1),
+    (GridLayoutGenerator, {"rows": 2, "cols": 2}, 4),
+    (TextOnImageLayoutGenerator, {"rows": 2, "cols": 2}, 4),
+]
+
+@pytest.mark.parametrize("cls, params, num_images", GENERATORS)
+def test_batch_leaves_the_global_rngs_alone(cls, params, num_images):
+    random.seed(5)
+    text_source.seed(5)
+    expected = (random.random(), text_source.text())
+
+    random.seed(5)
+    text_source.seed(5)
+    cls(**params).generate_batch(4, 400, 300, num_images, 2, paths=["a.jpg"], seed=1, with_text=True)
+    assert (random.random(), text_source.text()) == expected
+
+@pytest.mark.parametrize("cls, params, num_images", GENERATORS)
+def test_batch_texts_only_with_text(cls, params, num_images):
+    generator = cls(**params)
+    blank = generator.generate_batch(4, 400, 300, num_images, 2, paths=["a.jpg"], seed=1)
+    filled = generator.generate_batch(4, 400, 300, num_images, 2, paths=["a.jpg"], seed=1, with_text=True)
+    assert blank.texts == [""]
+    assert set(blank.ref[blank.kind == NODE_TEXT].tolist()) == {0}
+    assert all(text for text in filled.texts)
+    # the texts do not change the geometry
+    for name in ("x", "y", "w", "h", "kind"):
+        np.testing.assert_array_equal(getattr(blank, name), getattr(filled, name))
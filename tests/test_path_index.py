@@ -0,0 +1,50 @@
+import os
+import pickle
+import pytest
+
+from PathIndex import PathIndex
+
+def local_images(image_dir):
+    return sorted(os.path.relpath(os.path.join(root, name), image_dir) for root, _, names in os.walk(image_dir) for name in names)
+
+def test_index_reopens_and_resolves_lazily(tmp_path, image_dir):
+    prefix = str(tmp_path / "index" / ".local_paths")
+    paths = local_images(image_dir)
+    PathIndex.build(prefix, iter(paths))
+    assert PathIndex.exists(prefix)
+    assert not any(name.endswith(".tmp") or ".tmp." in name for name in os.listdir(tmp_path / "index"))
+
+    index = PathIndex(prefix)
+    # nothing is mapped before the first access
+    assert index._offsets is None and index._blob is None
+    assert len(index) == len(paths)
+    assert index[0] == paths[0] and index[-1] == paths[-1]
+    assert list(index) == paths
+    with pytest.raises(IndexError):
+        index[len(paths)]
+
+    # only the prefix is pickled, the copy maps the files itself
+    copy = pickle.loads(pickle.dumps(index))
+    assert copy._blob is None and list(copy) == paths
+
+def test_empty_index(tmp_path):
+    index = PathIndex.build(str(tmp_path / ".empty"), [])
+    assert len(index) == 0 and list(index) == []
+
+def test_custom_dataset_reuses_local_index(monkeypatch, image_dir):
+    pytest.importorskip("torch")
+    from DataLoader import CustomDataset
+
+    expected = [os.path.join(str(image_dir), path) for path in local_images(image_dir)]
+    dataset = CustomDataset(str(image_dir), source="local")
+    assert PathIndex.exists(dataset.index_path)
+    assert [dataset[i] for i in range(len(dataset))] == expected
+
+    # reopening must not walk the directory or rebuild the index
+    def build(*args, **kwargs):
+        raise AssertionError("index rebuilt")
+    monkeypatch.setattr(PathIndex, "build", staticmethod(build))
+    (image_dir / "a" / "new.jpg").write_bytes(b"")
+    reopened = CustomDataset(str(image_dir), source="local")
+    assert reopened.paths._blob is None
+    assert [reopened[i] for i in range(len(reopened))] == expected
@@ -0,0 +1,133 @@
+import os
+import json
+import pytest
+import numpy as np
+
+import generate
+from RunManifest import RunManifest, file_sha256
+from ImageCache import image_cache
+
+cv2 = pytest.importorskip("cv2")
+
+@pytest.fixture
+def image_dir(tmp_path):
+    """ Photos several times larger than the grid cells, so that they are drawn from reduced levels """
+    rng = np.random.default_rng(3)
+    root = tmp_path / "photos"
+    root.mkdir()
+    for i, (w, h) in enumerate([(960, 720), (640, 900), (1200, 800), (800, 800)]):
+        yy, xx = np.mgrid[0:h, 0:w]
+        img = np.stack([xx * 255 // w, yy * 255 // h, (xx * yy) % 256], axis=-1)
+        cv2.imwrite(str(root / f"{i}.jpg"), np.clip(img + rng.integers(-40, 40, img.shape), 0, 255).astype(np.uint8))
+    return root
+
+def write_recipe(tmp_path, image_dir, output):
+    recipe = {
+        "seed": 7,
+        "total": 12,
+        "chunk_size": 4,
+        "format": "yolo",
+        "workers": 1,
+        "output": str(tmp_path / output),
+        "images": {"dir": str(image_dir), "source": "local"},
+        "sizes": [[240, 180]],
+        "layouts": [
+            {"generator": "SingleImageLayoutGenerator", "num_images": 1, "num_texts": [0, 2], "weight": 1},
+            {"generator": "GridLayoutGenerator", "params": {"rows": 2, "cols": 2}, "num_images": [2, 4], "num_texts": [0, 2], "weight": 1},
+        ],
+    }
+    path = tmp_path / f"{output}.json"
+    path.write_text(json.dumps(recipe))
+    return generate.load_recipe(str(path))
+
+def start(recipe, spec=None, verify=False):
+    # every run starts in a new process
+    image_cache.clear()
+    entries = generate.recipe_entries(recipe)
+    chunks = generate.plan_chunks(recipe, entries)
+    generate.run(recipe, entries, chunks, workers=1, spec=spec, verify=verify)
+    return chunks
+
+def outputs(output_dir):
+    """ Digest of every image and label by path relative to output_dir """
+    files = {}
+    for kind in ("images", "labels"):
+        for root, _, names in os.walk(os.path.join(output_dir, kind)):
+            for name in names:
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, output_dir)] = file_sha256(path)
+    return files
+
+@pytest.fixture(autouse=True)
+def local_paths(monkeypatch):
+    # CustomDataset needs torch, the image list is all these runs take from it
+    def load_paths(recipe):
+        image_dir = recipe["images"]["dir"]
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(image_dir) for name in names if name.endswith(".jpg"))
+    monkeypatch.setattr(generate, "load_paths", load_paths)
+
+@pytest.fixture
+def reference(tmp_path, image_dir):
+    recipe = write_recipe(tmp_path, image_dir, "reference")
+    chunks = start(recipe)
+    return recipe, chunks, outputs(recipe["output"])
+
+def test_records_skip_a_torn_last_line(tmp_path):
+    manifest = RunManifest(str(tmp_path))
+    chunk = {"id": 0, "start_id": 1, "count": 1, "path_offset": 0}
+    (tmp_path / "a.txt").write_text("a")
+    manifest.record_chunk(chunk, ["a.txt"], (1, 1))
+    with open(manifest.path, "ab") as f:
+        f.write(b'{"chunk":1,"start_')
+    assert list(manifest.records()) == [0]
+
+    # the next record starts on a line of its own
+    manifest.record_chunk({**chunk, "id": 2}, ["a.txt"], (1, 1))
+    assert list(manifest.records()) == [0, 2]
+    assert manifest.verify(manifest.records()[2], full=True) == []
+
+def test_verify_reports_tampered_and_deleted_files(reference):
+    recipe, _, _ = reference
+    manifest = RunManifest(recipe["output"])
+    record = manifest.records()[0]
+    names = [line.split("  ", 1)[1] for line in open(os.path.join(recipe["output"], record["shard"])).read().splitlines()]
+    label = next(name for name in names if name.startswith("labels/"))
+    image = next(name for name in names if name.startswith("images/"))
+
+    with open(os.path.join(recipe["output"], label), "a") as f:
+        f.write("0 0.5 0.5 0.1 0.1\n")
+    os.remove(os.path.join(recipe["output"], image))
+    assert manifest.verify(record) == [(image, "missing")]
+    assert sorted(manifest.verify(record, full=True)) == sorted([(image, "missing"), (label, "modified")])
+
+    with open(os.path.join(recipe["output"], record["shard"]), "a") as f:
+        f.write("0" * 64 + "  extra\n")
+    assert manifest.verify(record) == [(record["shard"], "does not match the manifest")]
+
+def test_resumed_run_matches_an_uninterrupted_run(tmp_path, image_dir, reference):
+    _, reference_chunks, expected = reference
+    recipe = write_recipe(tmp_path, image_dir, "resumed")
+    output = recipe["output"]
+
+    # crash after the first chunk, in the middle of appending the second chunk's record
+    chunks = start(recipe, spec="0")
+    with open(os.path.join(output, "manifest.jsonl"), "ab") as f:
+        f.write(b'{"chunk":1,"start_id"')
+    manifest = RunManifest(output)
+    assert list(manifest.records()) == [0]
+
+    start(recipe)
+    assert chunks == reference_chunks
+    assert outputs(output) == expected
+    records = manifest.records()
+    assert sorted(records) == [chunk["id"] for chunk in chunks]
+    assert all(manifest.verify(record, full=True) == [] for record in records.values())
+
+    # a tampered label and a deleted image are found with verify and generated again
+    names = sorted(name for name in expected if name.startswith("labels/"))
+    with open(os.path.join(output, names[0]), "w") as f:
+        f.write("tampered\n")
+    os.remove(os.path.join(output, names[-1].replace("labels/", "images/", 1).replace(".txt", recipe["ext"])))
+    start(recipe, verify=True)
+    assert outputs(output) == expected
+    assert all(manifest.verify(record, full=True) == [] for record in manifest.records().values())
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from utils.yolo_bbox import convert_bbox_to_yolo, convert_bboxes_to_yolo, convert_yolo_to_bboxes
+
+ORDERS = [['tl_x', 'tl_y', 'br_x', 'br_y'], ['tl_x', 'tl_y', 'width', 'height'], ['tl', 'tr', 'br', 'bl']]
+
+def random_boxes(rng, order, n=200):
+    x1, y1 = rng.uniform(0, 500, n), rng.uniform(0, 400, n)
+    w, h = rng.uniform(1, 300, n), rng.uniform(1, 300, n)
+    if order == ORDERS[0]:
+        return np.stack([x1, y1, x1 + w, y1 + h], axis=1)
+    if order == ORDERS[1]:
+        return np.stack([x1, y1, w, h], axis=1)
+    return np.stack([np.stack([x1, x1 + w, x1 + w, x1], axis=1), np.stack([y1, y1, y1 + h, y1 + h], axis=1)], axis=2)
+
+@pytest.mark.parametrize("order", ORDERS)
+def test_vectorized_matches_scalar_exactly(order):
+    rng = np.random.default_rng(0)
+    img_size = (797, 613)
+    for boxes in (random_boxes(rng, order), np.round(random_boxes(rng, order))):
+        expected = [convert_bbox_to_yolo(img_size, box.tolist(), order) for box in boxes]
+        assert convert_bboxes_to_yolo(img_size, boxes, order).tolist() == [list(box) for box in expected]
+
+@pytest.mark.parametrize("order", ORDERS)
+def test_round_trip(order):
+    boxes = random_boxes(np.random.default_rng(1), order)
+    yolo = convert_bboxes_to_yolo((800, 600), boxes, order)
+    np.testing.assert_allclose(convert_yolo_to_bboxes((800, 600), yolo, order), boxes)
+
+def test_invalid_order():
+    with pytest.raises(ValueError):
+        convert_bboxes_to_yolo((10, 10), [[0, 0, 1, 1]], ['x', 'y', 'w', 'h'])
@@ -0,0 +1,67 @@
+import zipfile
+import pytest
+import numpy as np
+
+from ZipImageSource import ZipImageSource, zip_uri, is_zip_uri, split_zip_uri
+from ImageCache import ImageCache, decode_image
+
+cv2 = pytest.importorskip("cv2")
+
+@pytest.fixture
+def archives(tmp_path):
+    """ Two archives holding PNGs (lossless, so decoded pixels can be compared), stored and deflated """
+    rng = np.random.default_rng(1)
+    root = tmp_path / "zips"
+    (root / "set").mkdir(parents=True)
+    images = {}
+    for name, compression in (("stored.zip", zipfile.ZIP_STORED), ("set/deflated.zip", zipfile.ZIP_DEFLATED)):
+        with zipfile.ZipFile(root / name, "w", compression) as zf:
+            zf.writestr("photos/", b"")
+            zf.writestr("readme.txt", b"not an image")
+            for i in range(2):
+                img = rng.integers(0, 255, (30 + 10 * i, 40, 3), dtype=np.uint8)
+                member = f"photos/{i}.png"
+                zf.writestr(member, cv2.imencode(".png", img)[1].tobytes())
+                images[zip_uri(str(root / name), member)] = img
+    return root, images
+
+def test_uri_round_trip():
+    uri = zip_uri("data/set.zip", "a/b.jpg")
+    assert uri == "data/set.zip::a/b.jpg" and is_zip_uri(uri)
+    assert split_zip_uri(uri) == ("data/set.zip", "a/b.jpg")
+    assert not is_zip_uri("data/a/b.jpg")
+
+def test_stored_and_deflated_members_decode(archives):
+    root, images = archives
+    source = ZipImageSource()
+    assert source.members(str(root / "stored.zip"), (".png",)) == ["photos/0.png", "photos/1.png"]
+    assert source.members(str(root / "stored.zip")) == ["photos/0.png", "photos/1.png", "readme.txt"]
+    # stored members are sliced out of the archive's memory map
+    assert isinstance(source.read(zip_uri(str(root / "stored.zip"), "photos/0.png")), memoryview)
+    assert isinstance(source.read(zip_uri(str(root / "set/deflated.zip"), "photos/0.png")), bytes)
+    with pytest.raises(KeyError):
+        source.read(zip_uri(str(root / "stored.zip"), "photos/missing.png"))
+    source.close()
+
+    for uri, img in images.items():
+        np.testing.assert_array_equal(decode_image(uri), img)
+    assert decode_image(zip_uri(str(root / "stored.zip"), "photos/missing.png")) is None
+    assert decode_image(zip_uri(str(root / "missing.zip"), "photos/0.png")) is None
+
+def test_image_cache_reads_zip_uris(archives):
+    _, images = archives
+    cache = ImageCache()
+    uri, img = next(iter(images.items()))
+    np.testing.assert_array_equal(cache.get(uri), img)
+    assert cache.get(uri) is not None and cache.stats()["hits"] == 1
+
+def test_dataset_zip_source(archives):
+    pytest.importorskip("torch")
+    from DataLoader import CustomDataset
+
+    root, images = archives
+    dataset = CustomDataset(str(root), source="zip")
+    assert sorted(dataset[i] for i in range(len(dataset))) == sorted(images)
+    assert sorted(set(dataset.groups())) == ["set/deflated.zip", "stored.zip"]
+    for i in range(len(dataset)):
+        np.testing.assert_array_equal(decode_image(dataset[i]), images[dataset[i]])
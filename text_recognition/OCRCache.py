@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import numpy as np
+
+class OCRCache:
+    """
+    On-disk cache of easyocr results keyed by image content and recognizer configuration.
+
+    Boxes are stored as a float32 (N, 4, 2) blob and the texts as a JSON list in a sqlite
+    database, so several worker processes can share one cache file. The payload size is
+    kept as a running total next to the entries, and once it exceeds max_bytes the least
+    recently used entries are evicted. A hit refreshes the entry's last use at most once
+    per touch_interval seconds, so hits rarely write to the database.
+
+    Parameters:
+    - path: sqlite file, created if missing
+    - config: string describing everything that changes the OCR output (languages, model version, ...)
+    - max_bytes: size cap of the stored payload
+    - touch_interval: granularity in seconds of the last use of an entry
+    """
+    def __init__(self, path, config="", max_bytes=256 * 1024 * 1024, touch_interval=60.0):
+        self.path = path
+        self.config = config
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # sqlite connections must not cross a fork, reopen in every process
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr ("
+                "key TEXT PRIMARY KEY, boxes BLOB, texts TEXT, size INTEGER, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_last_used ON ocr(last_used)")
+            # running payload size, summed once when the table is first created
+            with self._conn:
+                self._conn.execute("CREATE TABLE IF NOT EXISTS ocr_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER)")
+                self._conn.execute("INSERT OR IGNORE INTO ocr_size SELECT 0, COALESCE(SUM(size), 0) FROM ocr")
+            self._pid = os.getpid()
+        return self._conn
+
+    def key(self, img):
+        h = hashlib.blake2b(digest_size=20)
+        h.update(self.config.encode())
+        h.update(str(img.shape).encode())
+        h.update(np.ascontiguousarray(img).data)
+        return h.hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT boxes, texts, last_used FROM ocr WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        now = time.time()
+        if now - row[2] >= self.touch_interval:
+            with self.conn:
+                self.conn.execute("UPDATE ocr SET last_used = ? WHERE key = ?", (now, key))
+
+        boxes = np.frombuffer(row[0], dtype=np.float32).reshape(-1, 4, 2)
+        texts = json.loads(row[1])
+        return [(box.tolist(), text) for box, text in zip(boxes, texts)]
+
+    def put(self, key, results):
+        boxes = np.array([bbox for bbox, *_ in results], dtype=np.float32).reshape(-1, 4, 2)
+        texts = json.dumps([res[1] for res in results])
+        blob = boxes.tobytes()
+        size = len(blob) + len(texts) + len(key)
+        with self.conn:
+            old = self.conn.execute("SELECT size FROM ocr WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO ocr VALUES (?, ?, ?, ?, ?)", (key, blob, texts, size, time.time()))
+            total = self.conn.execute(
+                "UPDATE ocr_size SET total = total + ? RETURNING total", (size - (old[0] if old else 0),)
+            ).fetchone()[0]
+        if total > self.max_bytes:
+            self._evict(total - self.max_bytes)
+
+    def size(self):
+        return self.conn.execute("SELECT total FROM ocr_size").fetchone()[0]
+
+    def _evict(self, excess):
+        # drop the oldest entries until we are back under the cap
+        freed = 0
+        keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM ocr ORDER BY last_used"):
+            keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        with self.conn:
+            # another process may have evicted some of them already, only count what is deleted here
+            deleted = 0
+            for key in keys:
+                row = self.conn.execute("DELETE FROM ocr WHERE key = ? RETURNING size", key).fetchone()
+                deleted += row[0] if row else 0
+            self.conn.execute("UPDATE ocr_size SET total = total - ?", (deleted,))
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
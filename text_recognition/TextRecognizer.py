@@ -1,44 +1,133 @@
-import easyocr
 import cv2
-from utils.yolo_bbox import convert_bbox_to_yolo
+from utils.yolo_bbox import convert_bboxes_to_yolo
+from text_recognition.OCRCache import OCRCache
+from utils import instrument
 
 # TODO: Read about image size in yolo format
 class TextRecognizer:
-    def __init__(self):
-        self.reader = easyocr.Reader(['en'])
+    def __init__(self, gpu=False, batch_size=8, cache_path=None, cache_max_bytes=256 * 1024 * 1024):
+        # easyocr pulls in torch, only import it when a recognizer is actually built
+        import easyocr
+        self.languages = ['en']
+        self.reader = easyocr.Reader(self.languages, gpu=gpu)
+        self.batch_size = batch_size
 
-    def recognize(self, image_path, yolo_format=True):
-        results = self.reader.readtext(image_path, paragraph=True)
-        if not yolo_format:
-            return results
-        
-        img = cv2.imread(image_path)
+        # Results are cached per image content, anything that changes them goes into the config
+        self.cache = None
+        if cache_path is not None:
+            config = f"easyocr={easyocr.__version__};lang={','.join(self.languages)};paragraph=True"
+            self.cache = OCRCache(cache_path, config=config, max_bytes=cache_max_bytes)
+
+    @staticmethod
+    def load_image(image):
+        # Accepts a path or an already decoded BGR array so callers can decode once
+        if not isinstance(image, str):
+            return image
+        img = cv2.imread(image)
         if img is None:
-            raise ValueError(f"Image at path {image_path} could not be loaded.")
-        
+            raise ValueError(f"Image at path {image} could not be loaded.")
+        return img
+
+    @staticmethod
+    def to_yolo(img, results):
         # Return bounding boxes in YOLO format (x_center, y_center, width, height)
-        yolo_results = []
+        if not results:
+            return []
         img_size = (img.shape[1], img.shape[0])  # (width, height)
-        for bbox, text in results:
-            yolo_bbox = convert_bbox_to_yolo(img_size, bbox, ['tl', 'tr', 'br', 'bl'])
-            yolo_results.append((yolo_bbox, text))
-        return yolo_results
+        yolo_bboxes = convert_bboxes_to_yolo(img_size, [bbox for bbox, *_ in results], ['tl', 'tr', 'br', 'bl'])
+        return [(tuple(yolo_bbox), res[1]) for yolo_bbox, res in zip(yolo_bboxes.tolist(), results)]
 
-    def get_masked_image(self, image_path):
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Image at path {image_path} could not be loaded.")
+    @staticmethod
+    def mask(img, results):
         masked_img = img.copy()
-        boxes = self.recognize(image_path, False)
-
-        for bbox, _ in boxes:
+        for bbox, _ in results:
             (tl, tr, br, bl) = bbox
             x1, y1 = map(int, tl)
             x2, y2 = map(int, br)
             cv2.rectangle(masked_img, (x1, y1), (x2, y2), (255, 255, 255), -1)
-
         return masked_img
 
+    def _readtext(self, img):
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(img)
+            results = self.cache.get(key)
+            if results is not None:
+                instrument.count("ocr.cache_hit")
+                return results
+
+        # easyocr expects RGB arrays (it decodes paths to RGB itself)
+        with instrument.timer("ocr.readtext"):
+            results = self.reader.readtext(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), paragraph=True)
+        if key is not None:
+            self.cache.put(key, results)
+        return results
+
+    @instrument.timed("ocr.recognize")
+    def recognize(self, image_path, yolo_format=True):
+        img = self.load_image(image_path)
+        results = self._readtext(img)
+        if not yolo_format:
+            return results
+        return self.to_yolo(img, results)
+
+    @instrument.timed("ocr.get_masked_image")
+    def get_masked_image(self, image_path):
+        img = self.load_image(image_path)
+        return self.mask(img, self._readtext(img))
+
+    @instrument.timed("ocr.recognize_batch")
+    def recognize_batch(self, images):
+        """
+        Run text detection and recognition on a list of images.
+
+        Parameters:
+        - images: list of paths or decoded BGR arrays, each is decoded at most once
+
+        Returns:
+        - (imgs, results): decoded images and the easyocr results for each of them
+        """
+        imgs = [self.load_image(image) for image in images]
+        results = [None] * len(imgs)
+        keys = [None] * len(imgs)
+
+        # readtext_batched needs equally sized inputs, so batch images of the same shape together
+        groups = {}
+        for i, img in enumerate(imgs):
+            if self.cache is not None:
+                keys[i] = self.cache.key(img)
+                results[i] = self.cache.get(keys[i])
+                if results[i] is not None:
+                    instrument.count("ocr.cache_hit")
+                    continue
+            groups.setdefault(img.shape, []).append(i)
+
+        for indices in groups.values():
+            for start in range(0, len(indices), self.batch_size):
+                chunk = indices[start:start + self.batch_size]
+                batch = [cv2.cvtColor(imgs[i], cv2.COLOR_BGR2RGB) for i in chunk]
+                with instrument.timer("ocr.readtext"):
+                    if len(batch) == 1:
+                        batch_results = [self.reader.readtext(batch[0], paragraph=True)]
+                    else:
+                        batch_results = self.reader.readtext_batched(batch, batch_size=len(batch), paragraph=True)
+                for i, res in zip(chunk, batch_results):
+                    results[i] = res
+                    if keys[i] is not None:
+                        self.cache.put(keys[i], res)
+
+        return imgs, results
+
+    def process_batch(self, images):
+        """
+        Mask the text in a list of images with a single pass of the model.
+
+        Returns:
+        - list of (masked_img, yolo_boxes) with yolo_boxes as returned by recognize()
+        """
+        imgs, results = self.recognize_batch(images)
+        return [(self.mask(img, res), self.to_yolo(img, res)) for img, res in zip(imgs, results)]
+
 # import os
 # recognizer = TextRecognizer()
 # images_path = "../stitching/images"
@@ -0,0 +1,300 @@
+import os
+import sys
+import json
+import time
+import atexit
+import bisect
+import threading
+import functools
+import contextlib
+
+# Off unless MACROSEG_INSTRUMENT=1 or enable() is called; a disabled timer costs one global lookup.
+# With MACROSEG_INSTRUMENT_OUT set, every process exports to that path ({pid} is replaced by its
+# pid) at exit and at most every FLUSH_INTERVAL seconds, so pool workers that are terminated
+# without running exit handlers still leave their numbers behind.
+_enabled = os.environ.get('MACROSEG_INSTRUMENT', '0') == '1'
+_out_path = os.environ.get('MACROSEG_INSTRUMENT_OUT')
+FLUSH_INTERVAL = 10.0
+
+# Upper bounds in seconds of the latency buckets, 10us to ~170s in factors of 2
+BUCKETS = tuple(1e-5 * 2 ** i for i in range(25))
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_last_flush = time.monotonic()
+
+
+class Histogram:
+    """ Latency distribution of one stage over the fixed BUCKETS. """
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation, the max for the +Inf bucket
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': self.buckets,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls()
+        hist.buckets = list(data['buckets'])
+        hist.count = data['count']
+        hist.sum = data['sum']
+        hist.max = data['max']
+        return hist
+
+    def merge(self, other):
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+
+def enable(out_path=None):
+    """ Start recording; with out_path, also export there periodically and at exit """
+    global _enabled, _out_path
+    _enabled = True
+    if out_path is not None:
+        _out_path = out_path
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def observe(stage, seconds):
+    if not _enabled:
+        return
+    with _lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = _histograms[stage] = Histogram()
+        hist.observe(seconds)
+    _maybe_flush()
+
+
+def count(name, n=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+@contextlib.contextmanager
+def timer(stage):
+    """ Time the enclosed block as one observation of `stage` """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """ Decorator timing every call of the function as `stage` """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    with _lock:
+        return {
+            'pid': os.getpid(),
+            'time': time.time(),
+            'stages': {stage: hist.to_dict() for stage, hist in sorted(_histograms.items())},
+            'counters': dict(sorted(_counters.items())),
+        }
+
+
+def merge(snapshots):
+    """ Combine snapshots, e.g. the exports of all workers of a run, into one """
+    histograms, counters = {}, {}
+    for snap in snapshots:
+        for stage, data in snap['stages'].items():
+            hist = Histogram.from_dict(data)
+            if stage in histograms:
+                histograms[stage].merge(hist)
+            else:
+                histograms[stage] = hist
+        for name, n in snap['counters'].items():
+            counters[name] = counters.get(name, 0) + n
+    return {
+        'pid': None,
+        'time': max((snap['time'] for snap in snapshots), default=time.time()),
+        'stages': {stage: hist.to_dict() for stage, hist in sorted(histograms.items())},
+        'counters': dict(sorted(counters.items())),
+    }
+
+
+def to_prometheus(snap, prefix='macroseg'):
+    """ Prometheus text exposition format: one histogram per stage plus the counters """
+    lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+    for stage, data in snap['stages'].items():
+        cumulative = 0
+        for bound, n in zip(BUCKETS + (float('inf'),), data['buckets']):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else f"{bound:.6g}"
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {data["sum"]}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+    lines.append(f"# TYPE {prefix}_events_total counter")
+    for name, n in snap['counters'].items():
+        lines.append(f'{prefix}_events_total{{name="{name}"}} {n}')
+    return "\n".join(lines) + "\n"
+
+
+def export(path, snap=None):
+    """ Write a snapshot to path, as Prometheus text for .prom/.txt files and JSON otherwise """
+    snap = snap if snap is not None else snapshot()
+    path = path.format(pid=os.getpid())
+    if path.endswith(('.prom', '.txt')):
+        data = to_prometheus(snap)
+    else:
+        data = json.dumps(snap, indent=2)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _maybe_flush():
+    global _last_flush
+    if _out_path is None:
+        return
+    now = time.monotonic()
+    if now - _last_flush < FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    export(_out_path)
+
+
+def _after_fork():
+    # a forked worker starts empty, otherwise its export would repeat the parent's numbers
+    global _lock, _last_flush
+    _lock = threading.Lock()
+    _histograms.clear()
+    _counters.clear()
+    _last_flush = time.monotonic()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+@atexit.register
+def _export_at_exit():
+    if _enabled and _out_path is not None and (_histograms or _counters):
+        export(_out_path)
+
+
+@contextlib.contextmanager
+def profiler(path, interval=0.001):
+    """
+    Profile the enclosed block into path. Uses the pyinstrument sampling profiler when it is
+    installed (HTML report for .html paths, text otherwise) and cProfile (pstats file) when not.
+    """
+    path = path.format(pid=os.getpid())
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+
+    if Profiler is not None:
+        prof = Profiler(interval=interval)
+        prof.start()
+        try:
+            yield prof
+        finally:
+            prof.stop()
+            with open(path, 'w') as f:
+                f.write(prof.output_html() if path.endswith('.html') else prof.output_text())
+        return
+
+    import cProfile
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield prof
+    finally:
+        prof.disable()
+        prof.dump_stats(path)
+
+
+def _report(snap):
+    lines = [f"{'stage':<40}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for stage, data in snap['stages'].items():
+        lines.append(f"{stage:<40}{data['count']:>8}" + "".join(
+            f"{1000 * data[key]:>10.2f}" for key in ('mean', 'p50', 'p90', 'p99', 'max')))
+    for name, n in snap['counters'].items():
+        lines.append(f"{name:<40}{n:>8}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m utils.instrument merged.json worker-1.json worker-2.json ...
+    # merges per-process exports and prints a per-stage summary
+    if len(sys.argv) < 3:
+        sys.exit("usage: python -m utils.instrument OUTPUT INPUT [INPUT ...]")
+    snaps = []
+    for input_path in sys.argv[2:]:
+        with open(input_path) as f:
+            snaps.append(json.load(f))
+    merged = merge(snaps)
+    export(sys.argv[1], merged)
+    print(_report(merged))
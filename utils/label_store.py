@@ -0,0 +1,185 @@
+import os
+import glob
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Every record in a .bin shard is a little-endian uint32 payload length followed by the payload.
+# Every record in the matching .idx file is (offset: uint64, length: uint32, key length: uint16, key).
+_LEN = struct.Struct('<I')
+_IDX = struct.Struct('<QIH')
+
+
+def _codec(name):
+    if name == 'msgpack':
+        if msgpack is None:
+            raise ImportError("msgpack is required to read this label store")
+        return (lambda obj: msgpack.packb(obj, use_bin_type=True)), (lambda data: msgpack.unpackb(data, raw=False))
+    if name == 'json':
+        return (lambda obj: json.dumps(obj, separators=(',', ':')).encode()), (lambda data: json.loads(data))
+    raise ValueError(f"Unknown codec: {name}")
+
+
+class LabelStore:
+    """
+    Append-only, sharded store of layout labels (the dicts returned by get_label()).
+
+    Records are length-prefixed msgpack (or compact JSON when msgpack is not installed)
+    in .bin shards with an offset index next to each shard, so a layout can be read
+    by key without parsing anything else and the whole store can be streamed in order.
+
+    Several processes can write to the same store as long as each uses its own prefix,
+    shards are named {prefix}-{n:05d}.bin and a new one is started past max_shard_bytes.
+
+    Parameters:
+    - path: directory of the store
+    - prefix: shard name prefix used by this writer
+    - codec: 'msgpack' or 'json', only used when the store is created
+    - max_shard_bytes: size after which the writer starts a new shard
+    """
+    def __init__(self, path, prefix='labels', codec=None, max_shard_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        os.makedirs(path, exist_ok=True)
+
+        meta_path = os.path.join(path, 'store.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.codec = json.load(f)['codec']
+        else:
+            self.codec = codec or ('msgpack' if msgpack is not None else 'json')
+            tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'codec': self.codec}, f)
+            os.replace(tmp_path, meta_path)
+        self._encode, self._decode = _codec(self.codec)
+
+        self._bin = None
+        self._idx = None
+        self._index = None
+        self._readers = {}
+
+    # Writing
+
+    def _open_shard(self):
+        self.close()
+        n = len(glob.glob(os.path.join(self.path, f"{self.prefix}-*.bin")))
+        shard = os.path.join(self.path, f"{self.prefix}-{n:05d}")
+        self._bin = open(shard + '.bin', 'ab')
+        self._idx = open(shard + '.idx', 'ab')
+
+    def append(self, key, label):
+        if self._bin is None or self._bin.tell() >= self.max_shard_bytes:
+            self._open_shard()
+        key = str(key).encode()
+        payload = self._encode(label)
+        offset = self._bin.tell()
+        self._bin.write(_LEN.pack(len(payload)) + payload)
+        self._bin.flush()
+        # the index entry goes last, a record without one is ignored by readers
+        self._idx.write(_IDX.pack(offset, len(payload), len(key)) + key)
+        self._idx.flush()
+        if self._index is not None:
+            self._index[key.decode()] = (self._bin.name, offset + _LEN.size, len(payload))
+
+    def close(self):
+        for f in (self._bin, self._idx):
+            if f is not None:
+                f.close()
+        self._bin = self._idx = None
+        for f in self._readers.values():
+            f.close()
+        self._readers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Reading
+
+    def shards(self):
+        return sorted(glob.glob(os.path.join(self.path, '*.idx')))
+
+    @staticmethod
+    def _read_index(idx_path):
+        with open(idx_path, 'rb') as f:
+            data = f.read()
+        pos = 0
+        # a truncated trailing entry (interrupted writer) is dropped
+        while pos + _IDX.size <= len(data):
+            offset, length, key_len = _IDX.unpack_from(data, pos)
+            pos += _IDX.size
+            if pos + key_len > len(data):
+                break
+            yield data[pos:pos + key_len].decode(), offset, length
+            pos += key_len
+
+    @property
+    def index(self):
+        # key -> (shard, payload offset, payload length), loaded on first random access
+        if self._index is None:
+            self._index = {}
+            for idx_path in self.shards():
+                bin_path = idx_path[:-len('.idx')] + '.bin'
+                for key, offset, length in self._read_index(idx_path):
+                    self._index[key] = (bin_path, offset + _LEN.size, length)
+        return self._index
+
+    def _read(self, bin_path, offset, length):
+        f = self._readers.get(bin_path)
+        if f is None:
+            f = self._readers[bin_path] = open(bin_path, 'rb')
+        f.seek(offset)
+        return self._decode(f.read(length))
+
+    def __getitem__(self, key):
+        return self._read(*self.index[str(key)])
+
+    def __contains__(self, key):
+        return str(key) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def __iter__(self):
+        """ Stream (key, label) pairs shard by shard in write order """
+        for idx_path in self.shards():
+            bin_path = idx_path[:-len('.idx')] + '.bin'
+            with open(bin_path, 'rb') as f:
+                for key, offset, length in self._read_index(idx_path):
+                    f.seek(offset + _LEN.size)
+                    yield key, self._decode(f.read(length))
+
+
+def import_json_dir(jsons_path, store_path, **store_args):
+    """
+    Copy every <name>.json label in jsons_path into the label store at store_path under key <name>.
+    """
+    with LabelStore(store_path, **store_args) as store:
+        for json_name in sorted(os.listdir(jsons_path)):
+            name, ext = os.path.splitext(json_name)
+            if ext != '.json':
+                continue
+            with open(os.path.join(jsons_path, json_name), 'r') as f:
+                store.append(name, json.load(f))
+
+
+def export_json_dir(store_path, jsons_path, indent=2):
+    """
+    Write every label of the store at store_path to jsons_path/<key>.json, in the layout of stitching/test.py.
+    """
+    os.makedirs(jsons_path, exist_ok=True)
+    with LabelStore(store_path) as store:
+        for key, label in store:
+            with open(os.path.join(jsons_path, f"{key}.json"), 'w') as f:
+                json.dump(label, f, indent=indent)
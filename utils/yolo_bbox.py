@@ -1,3 +1,5 @@
+import numpy as np
+
 def convert_bbox_to_yolo(img_size, bbox, order=['tl_x', 'tl_y', 'br_x', 'br_y']):
     """
     Convert bounding box to YOLO format (x_center, y_center, width, height).
@@ -33,3 +35,77 @@ def convert_bbox_to_yolo(img_size, bbox, order=['tl_x', 'tl_y', 'br_x', 'br_y'])
         raise ValueError("Invalid order specified.")
 
     return (x_center/img_size[0], y_center/img_size[1], width/img_size[0], height/img_size[1])
+
+
+def convert_bboxes_to_yolo(img_size, bboxes, order=['tl_x', 'tl_y', 'br_x', 'br_y']):
+    """
+    Vectorized convert_bbox_to_yolo for many boxes at once.
+
+    Parameters:
+    - img_size: tuple of (width, height) of the image
+    - bboxes: array-like of shape (N, 4) or, for the corner order, (N, 4, 2)
+    - order: same options as convert_bbox_to_yolo
+
+    Returns:
+    - (N, 4) float64 array of (x_center, y_center, width, height) normalized by img_size
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64)
+    # same arithmetic as convert_bbox_to_yolo for every order, so both give identical floats
+    if order == ['tl_x', 'tl_y', 'br_x', 'br_y']:
+        bboxes = bboxes.reshape(-1, 4)
+        x_center = (bboxes[:, 0] + bboxes[:, 2]) / 2.0
+        y_center = (bboxes[:, 1] + bboxes[:, 3]) / 2.0
+        width = bboxes[:, 2] - bboxes[:, 0]
+        height = bboxes[:, 3] - bboxes[:, 1]
+    elif order == ['tl_x', 'tl_y', 'width', 'height']:
+        bboxes = bboxes.reshape(-1, 4)
+        x_center = bboxes[:, 0] + bboxes[:, 2] / 2.0
+        y_center = bboxes[:, 1] + bboxes[:, 3] / 2.0
+        width = bboxes[:, 2]
+        height = bboxes[:, 3]
+    elif order == ['tl', 'tr', 'br', 'bl']:
+        bboxes = bboxes.reshape(-1, 4, 2)
+        x_center = (bboxes[:, 0, 0] + bboxes[:, 2, 0]) / 2.0
+        y_center = (bboxes[:, 0, 1] + bboxes[:, 2, 1]) / 2.0
+        width = bboxes[:, 2, 0] - bboxes[:, 0, 0]
+        height = bboxes[:, 2, 1] - bboxes[:, 0, 1]
+    else:
+        raise ValueError("Invalid order specified.")
+
+    yolo = np.empty((len(bboxes), 4), dtype=np.float64)
+    yolo[:, 0] = x_center / img_size[0]
+    yolo[:, 1] = y_center / img_size[1]
+    yolo[:, 2] = width / img_size[0]
+    yolo[:, 3] = height / img_size[1]
+    return yolo
+
+
+def convert_yolo_to_bboxes(img_size, yolo_bboxes, order=['tl_x', 'tl_y', 'br_x', 'br_y']):
+    """
+    Inverse of convert_bboxes_to_yolo: normalized (x_center, y_center, width, height) to pixels.
+
+    Parameters:
+    - img_size: tuple of (width, height) of the image
+    - yolo_bboxes: array-like of shape (N, 4)
+    - order: output layout, same options as convert_bbox_to_yolo
+
+    Returns:
+    - (N, 4) float64 array, or (N, 4, 2) for the corner order
+    """
+    yolo = np.asarray(yolo_bboxes, dtype=np.float64).reshape(-1, 4)
+    w = yolo[:, 2] * img_size[0]
+    h = yolo[:, 3] * img_size[1]
+    x1 = yolo[:, 0] * img_size[0] - w / 2.0
+    y1 = yolo[:, 1] * img_size[1] - h / 2.0
+    x2, y2 = x1 + w, y1 + h
+
+    if order == ['tl_x', 'tl_y', 'br_x', 'br_y']:
+        return np.stack([x1, y1, x2, y2], axis=1)
+    elif order == ['tl_x', 'tl_y', 'width', 'height']:
+        return np.stack([x1, y1, w, h], axis=1)
+    elif order == ['tl', 'tr', 'br', 'bl']:
+        xs = np.stack([x1, x2, x2, x1], axis=1)
+        ys = np.stack([y1, y1, y2, y2], axis=1)
+        return np.stack([xs, ys], axis=2)
+    else:
+        raise ValueError("Invalid order specified.")
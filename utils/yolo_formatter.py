@@ -1,67 +1,375 @@
 import os
 import cv2
 import json
-import shutil
+import time
+import queue
 import random
+import threading
+import numpy as np
+from multiprocessing import Pool
 from tqdm import tqdm
-from utils.yolo_bbox import convert_bbox_to_yolo
-from text_recognition.TextRecognizer import TextRecognizer
+from utils.yolo_bbox import convert_bboxes_to_yolo
+from utils.label_store import LabelStore
+from utils import instrument
 
-def process_node(node, img_size):
+def collect_bboxes(node, node_type='image'):
+    # pixel bboxes (tl_x, tl_y, br_x, br_y) of all nodes of the given type in the label tree
     bboxes = []
-    if node['type'] == 'image':
-        bboxes.append(convert_bbox_to_yolo(img_size, node['bbox']))
-    
-    elif node['type'] == 'container':
-        for child in node['children']:
-            bboxes.extend(process_node(child, img_size))
-
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node['type'] == node_type:
+            bboxes.append(node['bbox'])
+        elif node['type'] == 'container':
+            stack.extend(reversed(node['children']))
     return bboxes
 
 
-def process_files(name_list, images_path, jsons_path, out_images_path, out_labels_paths):
-    recognizer = TextRecognizer()
+def process_node(node, img_size):
+    bboxes = collect_bboxes(node, 'image')
+    if not bboxes:
+        return []
+    return [tuple(row) for row in convert_bboxes_to_yolo(img_size, bboxes).tolist()]
 
-    for name in tqdm(name_list):
-        image_src = os.path.join(images_path, f"{name}.png")
-        if not os.path.exists(image_src):
-            image_src = os.path.join(images_path, f"{name}.jpg")
-        if not os.path.exists(image_src):
-            image_src = os.path.join(images_path, f"{name}.jpeg")
-        if not os.path.exists(image_src):
-            print(f"Image file for {name} not found. Skipping.")
-            continue
 
-        img = cv2.imread(image_src)
-        if img is None:
-            print(f"Failed to load image {image_src}. Skipping.")
+MASK_MODES = ('labels', 'ocr', 'none')
+
+
+def mask_text_from_label(img, node, dilation=0):
+    """
+    Paint the text boxes recorded in the label tree white, as TextRecognizer.mask does
+    with the boxes easyocr finds. Boxes are mapped from layout coordinates onto the
+    image through the root bbox, so images rendered at another scale are masked too.
+
+    Parameters:
+    - img: rendered layout (BGR), not modified
+    - node: label tree of the layout
+    - dilation: pixels to grow every box by on each side
+    """
+    masked_img = img.copy()
+    bboxes = collect_bboxes(node, 'text')
+    if not bboxes:
+        return masked_img
+    h, w = img.shape[:2]
+    rx1, ry1, rx2, ry2 = node['bbox']
+    scale = np.array([w / max(rx2 - rx1, 1), h / max(ry2 - ry1, 1)] * 2)
+    boxes = (np.asarray(bboxes, dtype=np.float64) - [rx1, ry1, rx1, ry1]) * scale
+    boxes += [-dilation, -dilation, dilation, dilation]
+    boxes = np.clip(np.rint(boxes), 0, [w, h, w, h]).astype(np.int64)
+    for x1, y1, x2, y2 in boxes:
+        masked_img[y1:y2, x1:x2] = 255
+    return masked_img
+
+
+# LabelStores opened by load_label, one per store path and process
+_label_stores = {}
+
+
+def is_label_store(jsons_path):
+    return os.path.exists(os.path.join(jsons_path, 'store.json'))
+
+
+def _get_label_store(jsons_path):
+    # keyed by pid too, open file handles must not be shared with forked workers
+    key = (os.getpid(), jsons_path)
+    store = _label_stores.get(key)
+    if store is None:
+        store = _label_stores[key] = LabelStore(jsons_path)
+    return store
+
+
+def has_label(jsons_path, name):
+    if is_label_store(jsons_path):
+        return name in _get_label_store(jsons_path)
+    return os.path.exists(os.path.join(jsons_path, f"{name}.json"))
+
+
+def load_label(jsons_path, name):
+    # jsons_path is either a directory of <name>.json files or a LabelStore directory
+    if is_label_store(jsons_path):
+        return _get_label_store(jsons_path)[name]
+    with open(os.path.join(jsons_path, f"{name}.json"), 'r') as f:
+        return json.load(f)
+
+
+def find_image(images_path, name):
+    for ext in ('.png', '.jpg', '.jpeg'):
+        image_src = os.path.join(images_path, f"{name}{ext}")
+        if os.path.exists(image_src):
+            return image_src
+    return None
+
+
+def write_labels(label_file, bboxes):
+    # written to a temporary file first so an interrupted run never leaves a partial label
+    tmp_file = label_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        for bbox in bboxes:
+            # 0 is the class id for one image
+            f.write(f"0 {bbox[0]} {bbox[1]} {bbox[2]} {bbox[3]}\n")
+    os.replace(tmp_file, label_file)
+
+
+def write_dataset_yaml(output_path):
+    # macro_seg.yaml: train/val image folders of the dataset and its single class
+    with open(os.path.join(output_path, "macro_seg.yaml"), "w") as f:
+        f.write(f"""train: {os.path.join(output_path, 'images/train')}
+val: {os.path.join(output_path, 'images/val')}
+
+nc: 1
+names: ['image']
+""")
+
+
+class StageStats:
+    """ Items processed and busy time per pipeline stage. """
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds, items=1):
+        count, total = self.stages.get(stage, (0, 0.0))
+        self.stages[stage] = (count + items, total + seconds)
+
+    def merge(self, other):
+        for stage, (count, total) in other.stages.items():
+            self.add(stage, total, count)
+
+    def report(self, wall_time=None):
+        lines = []
+        for stage, (count, total) in self.stages.items():
+            rate = count / total if total > 0 else float('inf')
+            lines.append(f"{stage:>8}: {count} items, {total:.2f}s busy, {rate:.1f} items/s")
+        if wall_time is not None:
+            count = max((c for c, _ in self.stages.values()), default=0)
+            lines.append(f"{'total':>8}: {count} items in {wall_time:.2f}s, {count / max(wall_time, 1e-9):.1f} items/s")
+        return "\n".join(lines)
+
+
+# Set once per worker process by _init_builder_worker so the OCR model is loaded only once
+_builder_recognizer = None
+
+
+def _init_builder_worker(recognizer_args):
+    # recognizer_args is None unless the build masks with OCR
+    global _builder_recognizer
+    if recognizer_args is not None:
+        from text_recognition.TextRecognizer import TextRecognizer
+        _builder_recognizer = TextRecognizer(**recognizer_args)
+
+
+def _run_stage(stage, fn, inq, outq, stats):
+    # Generic pipeline stage: apply fn to every item until the None sentinel arrives
+    while True:
+        item = inq.get()
+        if item is None:
+            break
+        start = time.perf_counter()
+        try:
+            result = fn(item)
+        except Exception as e:
+            print(f"{stage} failed for {item[0][0]}: {e}. Skipping.")
+            instrument.count(f'builder.{stage}.failed')
+            result = None
+        elapsed = time.perf_counter() - start
+        stats.add(stage, elapsed)
+        instrument.observe(f'builder.{stage}', elapsed)
+        if result is not None and outq is not None:
+            outq.put(result)
+    if outq is not None:
+        outq.put(None)
+
+
+def _decode_job(job, images_path, jsons_path):
+    name = job[0]
+    image_src = find_image(images_path, name)
+    if image_src is None:
+        print(f"Image file for {name} not found. Skipping.")
+        return None
+    img = cv2.imread(image_src)
+    if img is None:
+        print(f"Failed to load image {image_src}. Skipping.")
+        return None
+    node = load_label(jsons_path, name)
+    return job, image_src, img, node
+
+
+def _encode_item(item):
+    job, image_src, img, node, masked_img = item
+    ok, buf = cv2.imencode(os.path.splitext(image_src)[1], masked_img)
+    if not ok:
+        raise ValueError(f"could not encode {image_src}")
+    img_size = (img.shape[1], img.shape[0])  # (width, height)
+    return job, image_src, buf, process_node(node, img_size)
+
+
+def _write_item(item):
+    (name, out_images_path, out_labels_path), image_src, buf, bboxes = item
+    # the label is written last, its presence marks the job as complete for resuming
+    image_dest = os.path.join(out_images_path, os.path.basename(image_src))
+    with open(image_dest + '.tmp', 'wb') as f:
+        f.write(buf.tobytes())
+    os.replace(image_dest + '.tmp', image_dest)
+    write_labels(os.path.join(out_labels_path, f"{name}.txt"), bboxes)
+    return item
+
+
+def _build_shard(jobs, images_path, jsons_path, queue_size, recognizer=None, mask_mode='labels', dilation=0):
+    """
+    Run decode -> mask -> encode -> write over one shard of jobs. Decode, encode and
+    write run in their own threads (cv2 and file I/O release the GIL) and are connected
+    to the masking stage by bounded queues, so a slow stage applies back-pressure
+    instead of buffering the whole shard in memory. Masking runs OCR in batches for
+    mask_mode 'ocr', otherwise it paints the label tree's text boxes or does nothing.
+    """
+    recognizer = recognizer or _builder_recognizer
+    stats = StageStats()
+    job_q = queue.Queue()
+    decoded_q = queue.Queue(maxsize=queue_size)
+    masked_q = queue.Queue(maxsize=queue_size)
+    encoded_q = queue.Queue(maxsize=queue_size)
+
+    for job in jobs:
+        job_q.put((job,))
+    job_q.put(None)
+
+    threads = [
+        threading.Thread(target=_run_stage, args=('decode', lambda item: _decode_job(item[0], images_path, jsons_path), job_q, decoded_q, stats)),
+        threading.Thread(target=_run_stage, args=('encode', _encode_item, masked_q, encoded_q, stats)),
+        threading.Thread(target=_run_stage, args=('write', _write_item, encoded_q, None, stats)),
+    ]
+    for t in threads:
+        t.start()
+
+    if mask_mode != 'ocr':
+        def mask_item(item):
+            job, image_src, img, node = item
+            masked_img = mask_text_from_label(img, node, dilation) if mask_mode == 'labels' else img
+            return job, image_src, img, node, masked_img
+        _run_stage('mask', mask_item, decoded_q, masked_q, stats)
+        for t in threads:
+            t.join()
+        return stats
+
+    # OCR stage in this thread: gather up to batch_size decoded images per model call
+    done = False
+    while not done:
+        batch = []
+        while len(batch) < recognizer.batch_size:
+            item = decoded_q.get()
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+        if not batch:
             continue
-        img_size = (img.shape[1], img.shape[0])  # (width, height)
+        start = time.perf_counter()
+        try:
+            masked = recognizer.process_batch([img for _, _, img, _ in batch])
+            for item, (masked_img, _) in zip(batch, masked):
+                masked_q.put((*item, masked_img))
+        except Exception as e:
+            print(f"ocr failed for batch starting at {batch[0][0][0]}: {e}. Skipping.")
+            instrument.count('builder.ocr.failed', len(batch))
+        elapsed = time.perf_counter() - start
+        stats.add('ocr', elapsed, len(batch))
+        instrument.observe('builder.ocr', elapsed)
+    masked_q.put(None)
 
-        image_dest = os.path.join(out_images_path, os.path.basename(image_src))
-        # shutil.copy(image_src, image_dest)
-        masked_img = recognizer.get_masked_image(image_src)
-        cv2.imwrite(image_dest, masked_img)
+    for t in threads:
+        t.join()
+    return stats
 
-        with open(os.path.join(jsons_path, f"{name}.json"), 'r') as f:
-            node = json.load(f)
-        
-        label_file = os.path.join(out_labels_paths, f"{name}.txt")
-        with open(label_file, 'w') as f:
-            bboxes = process_node(node, img_size)
-            for bbox in bboxes:
-                # 0 is the class id for one image
-                f.write(f"0 {bbox[0]} {bbox[1]} {bbox[2]} {bbox[3]}\n")
 
+def _build_shard_worker(args):
+    *shard, mask_mode, dilation = args
+    return _build_shard(*shard, mask_mode=mask_mode, dilation=dilation)
 
-def create_yolo_dataset(images_path, jsons_path, output_path, split_ratio=0.8):
+
+class YoloDatasetBuilder:
+    """
+    Converts stitched layouts (image + JSON) into YOLO images and labels.
+
+    Jobs are split into shards and handed to a pool of worker processes. Inside a
+    worker every shard runs as a decode -> mask -> encode -> write pipeline with
+    bounded queues between the stages. Text is masked with the boxes from the label
+    tree by default; with mask_mode 'ocr' each worker loads its own TextRecognizer
+    once and keeps it for the whole build (all splits).
+
+    Parameters:
+    - images_path, jsons_path: stitched layouts to convert
+    - num_workers: worker processes, 0 or 1 runs in the calling process
+    - queue_size: capacity of the queues between stages
+    - shard_size: jobs per task sent to a worker
+    - gpu, batch_size: passed to TextRecognizer (easyocr runs on the CPU unless gpu is set)
+    - cache_path: OCRCache file shared by all workers (no cache if None)
+    - resume: skip jobs whose label file already exists
+    - mask_mode: 'labels' (text boxes of the label tree), 'ocr' (easyocr, for images without text labels) or 'none'
+    - dilation: pixels to grow label text boxes by when masking
+    """
+    def __init__(self, images_path, jsons_path, num_workers=1, queue_size=32, shard_size=256, gpu=False, batch_size=8, cache_path=None, resume=True, mask_mode='labels', dilation=0):
+        if mask_mode not in MASK_MODES:
+            raise ValueError(f"Unknown mask mode: {mask_mode}")
+        self.images_path = images_path
+        self.jsons_path = jsons_path
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.shard_size = shard_size
+        self.recognizer_args = {'gpu': gpu, 'batch_size': batch_size, 'cache_path': cache_path}
+        self.resume = resume
+        self.mask_mode = mask_mode
+        self.dilation = dilation
+        self.stats = StageStats()
+
+    @staticmethod
+    def is_done(job):
+        name, _, out_labels_path = job
+        return os.path.exists(os.path.join(out_labels_path, f"{name}.txt"))
+
+    def build(self, jobs):
+        """
+        Process a list of (name, out_images_path, out_labels_path) jobs and return the StageStats.
+        """
+        start = time.perf_counter()
+        if self.resume:
+            pending = [job for job in jobs if not self.is_done(job)]
+            if len(pending) < len(jobs):
+                print(f"Resuming: {len(jobs) - len(pending)} of {len(jobs)} layouts already converted.")
+            jobs = pending
+        shards = [(jobs[i:i + self.shard_size], self.images_path, self.jsons_path, self.queue_size)
+                  for i in range(0, len(jobs), self.shard_size)]
+
+        use_ocr = self.mask_mode == 'ocr'
+        if self.num_workers <= 1:
+            recognizer = None
+            if use_ocr:
+                from text_recognition.TextRecognizer import TextRecognizer
+                recognizer = TextRecognizer(**self.recognizer_args)
+            for shard in tqdm(shards):
+                self.stats.merge(_build_shard(*shard, recognizer=recognizer, mask_mode=self.mask_mode, dilation=self.dilation))
+        else:
+            init_args = (self.recognizer_args if use_ocr else None,)
+            shards = [(*shard, self.mask_mode, self.dilation) for shard in shards]
+            with Pool(self.num_workers, initializer=_init_builder_worker, initargs=init_args) as pool:
+                for stats in tqdm(pool.imap_unordered(_build_shard_worker, shards), total=len(shards)):
+                    self.stats.merge(stats)
+
+        print(self.stats.report(time.perf_counter() - start))
+        return self.stats
+
+
+def create_yolo_dataset(images_path, jsons_path, output_path, split_ratio=0.8, num_workers=1, limit=None, seed=0, cache_path='', **builder_args):
     """
     Create YOLO formatted dataset from images and corresponding JSON annotations.
     
     Parameters:
     - images_path: Path to the directory containing images.
-    - jsons_path: Path to the directory containing JSON annotation files.
+    - jsons_path: Path to the directory containing JSON annotation files, or to a LabelStore.
     - output_path: Path to the directory where YOLO formatted files will be saved.
+    - num_workers: Number of worker processes, see YoloDatasetBuilder.
+    - limit: Maximum number of layouts to convert (all by default).
+    - seed: Seed of the train/val shuffle, fixed so that an interrupted run resumes with the same split.
+    - cache_path: OCR cache file, defaults to output_path/ocr_cache.sqlite; None disables the cache.
+    - builder_args: Extra YoloDatasetBuilder arguments (queue_size, shard_size, gpu, batch_size, mask_mode, dilation).
     """
     if not os.path.exists(output_path):
         os.makedirs(output_path)
@@ -78,34 +386,32 @@ def create_yolo_dataset(images_path, jsons_path, output_path, split_ratio=0.8):
     os.makedirs(out_train_labels_path, exist_ok=True)
     os.makedirs(out_val_labels_path, exist_ok=True)
 
+    if cache_path == '':
+        cache_path = os.path.join(output_path, 'ocr_cache.sqlite')
+
     extensions = ('.png', '.jpg', '.jpeg')
     name_list = []
-    for image_name in os.listdir(images_path):
+    for image_name in sorted(os.listdir(images_path)):
         name, ext = os.path.splitext(image_name)
         if ext.lower() in extensions:
-            json_file = os.path.join(jsons_path, f"{name}.json")
-            if not os.path.exists(json_file):
+            if not has_label(jsons_path, name):
                 print(f"JSON file for {image_name} not found. Skipping.")
                 continue
             name_list.append(name)
-            if len(name_list) >= 10:
+            if limit is not None and len(name_list) >= limit:
                 break
 
-    random.shuffle(name_list)
+    random.Random(seed).shuffle(name_list)
     split_index = int(len(name_list) * split_ratio)
     train_names = name_list[:split_index]
     val_names = name_list[split_index:]
-    process_files(train_names, images_path, jsons_path, out_train_images_path, out_train_labels_path)
-    process_files(val_names, images_path, jsons_path, out_val_images_path, out_val_labels_path)
+    jobs = [(name, out_train_images_path, out_train_labels_path) for name in train_names]
+    jobs += [(name, out_val_images_path, out_val_labels_path) for name in val_names]
+    builder = YoloDatasetBuilder(images_path, jsons_path, num_workers=num_workers, cache_path=cache_path, **builder_args)
+    builder.build(jobs)
 
-    yaml_path = os.path.join(output_path, "macro_seg.yaml")
-    with open(yaml_path, "w") as f:
-        f.write(f"""train: {os.path.join(output_path, 'images/train')}
-val: {os.path.join(output_path, 'images/val')}
-
-nc: 1
-names: ['image']
-""")
+    write_dataset_yaml(output_path)
 
 
-create_yolo_dataset("stitching/images", "stitching/jsons", "./temp")
\ No newline at end of file
+if __name__ == "__main__":
+    create_yolo_dataset("stitching/images", "stitching/jsons", "./temp")
\ No newline at end of file